@@ -0,0 +1,112 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+MEMORY_BUDGET = int(os.environ.get('DOC_MEMORY_BUDGET_BYTES', str(512 * 1024 * 1024)))
+HEAVY_BUDGET = int(os.environ.get('DOC_HEAVY_BUDGET_BYTES', str(MEMORY_BUDGET // 2)))
+HEAVY_REQUEST_BYTES = int(os.environ.get('DOC_HEAVY_REQUEST_BYTES', str(64 * 1024 * 1024)))
+ADMISSION_WAIT = float(os.environ.get('DOC_ADMISSION_WAIT', '30'))
+
+# Rough peak memory per input byte / loop item: the unzipped template XML and its lxml tree,
+# the data as Python objects, and the rendered XML of each row.
+TEMPLATE_FACTOR = 20
+DATA_FACTOR = 10
+ITEM_BYTES = 2048
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request does not fit its memory budget; status is the HTTP status to answer with.
+    """
+    def __init__(self, message, status=503, retry_after=5):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+def count_items(data):
+    """
+    Number of list elements anywhere in data, i.e. the total loop cardinality.
+    """
+    items = 0
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            items += len(value)
+            stack.extend(value)
+    return items
+
+def estimate_cost(template_bytes, data_bytes, items):
+    """
+    Estimated peak memory in bytes of rendering a request.
+    """
+    return template_bytes * TEMPLATE_FACTOR + data_bytes * DATA_FACTOR + items * ITEM_BYTES
+
+class Lane:
+    def __init__(self, name, budget):
+        self.name = name
+        self.budget = budget
+        self.reserved = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+class Admission:
+    """
+    Per-process memory budget for rendering. Each request reserves its estimated cost for as long
+    as it runs; requests costing heavy_request_bytes or more go to a separate heavy lane with a
+    budget of its own, so large jobs queue behind each other instead of starving small ones.
+    A request waits up to `wait` seconds for room in its lane (503 after that) and is refused at
+    once (413) if it is larger than the whole lane. A budget of 0 disables admission control.
+    """
+    def __init__(self, budget=MEMORY_BUDGET, heavy_budget=HEAVY_BUDGET,
+                 heavy_request_bytes=HEAVY_REQUEST_BYTES, wait=ADMISSION_WAIT):
+        self.enabled = budget > 0
+        self.heavy_request_bytes = heavy_request_bytes
+        self.wait = wait
+        self.light = Lane('light', budget - heavy_budget)
+        self.heavy = Lane('heavy', heavy_budget)
+        self._cond = threading.Condition()
+
+    def lane(self, cost):
+        return self.heavy if cost >= self.heavy_request_bytes and self.heavy.budget > 0 else self.light
+
+    @contextmanager
+    def admit(self, cost, wait=None):
+        if not self.enabled:
+            yield
+            return
+        wait = self.wait if wait is None else wait
+        lane = self.lane(cost)
+        with self._cond:
+            if cost > lane.budget:
+                lane.rejected += 1
+                raise AdmissionRejected(f"Request too large to render (estimated {cost // (1024 * 1024)} MiB).",
+                                        status=413, retry_after=None)
+            deadline = time.monotonic() + wait
+            lane.waiting += 1
+            try:
+                while lane.reserved + cost > lane.budget:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        lane.rejected += 1
+                        raise AdmissionRejected("Server is busy rendering large documents, retry later.")
+                    self._cond.wait(remaining)
+            finally:
+                lane.waiting -= 1
+            lane.reserved += cost
+            lane.admitted += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                lane.reserved -= cost
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {lane.name: {'budget': lane.budget, 'reserved': lane.reserved, 'waiting': lane.waiting,
+                                'admitted': lane.admitted, 'rejected': lane.rejected}
+                    for lane in (self.light, self.heavy)}
@@ -1,158 +1,916 @@
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, request, send_file, jsonify, stream_with_context, g
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from docxtpl import DocxTemplate
-from docx import Document
 import json
+import io
 from io import BytesIO
-import tempfile
-import subprocess
-import re
-import sys
 import os
 import jinja2
 import base64
+import hashlib
+import itertools
+import threading
+import uuid
+from collections.abc import Iterator
+import office
+from office import convert_to, convert_many, ConversionBusy
+from template_cache import TemplateCache
+from template_store import TemplateStore, TemplateNotFound, ImageNotFound, IMAGE_STORE_DIR
+from jobs import JobQueue, QueueFull
+from singleflight import SingleFlight
+from scratch import get_scratch
+from admission import Admission, AdmissionRejected, count_items, estimate_cost
+from output_cache import OutputCache, output_key, output_ext, canonical_json, MIMETYPES
+import fastjson
+import metrics
+import profiling
+from metrics import stage
+from warmup import LazyModule, Warmup
+
+# docxtpl, python-docx, docxcompose and lxml are only imported when first needed (or by the
+# warm-up thread), so the process is up and answering /ready right away.
+batch = LazyModule('batch')
+images = LazyModule('images')
+render = LazyModule('render')
+skeleton = LazyModule('skeleton')
+validator = LazyModule('validator')
+
+class JSONProvider(DefaultJSONProvider):
+    """
+    Parses request bodies with fastjson, i.e. orjson when it is installed.
+    """
+    def loads(self, s, **kwargs):
+        return fastjson.loads(s)
 
 app = Flask(__name__)
+app.json = JSONProvider(app)
 CORS(app)
 
-def validate_template(template_path):
-    doc = Document(template_path)
-    template_content = "\n".join([p.text for p in doc.paragraphs])
+template_cache = TemplateCache()
+template_store = TemplateStore()
+image_store = TemplateStore(root=IMAGE_STORE_DIR, ext='img', kind='image', not_found=ImageNotFound)
+job_queue = JobQueue()
+output_cache = OutputCache()
+single_flight = SingleFlight()
+admission = Admission()
+scratch = get_scratch()
+
+BATCH_CONVERT_SIZE = int(os.environ.get('DOC_BATCH_CONVERT_SIZE', '100'))
+PREWARM_OFFICE = os.environ.get('DOC_PREWARM_OFFICE', '1') == '1'
+STREAM_RENDER_ROWS = int(os.environ.get('DOC_STREAM_RENDER_ROWS', '5000'))
+PRUNE_DATA = os.environ.get('DOC_PRUNE_DATA', '0') == '1'
+
+metrics.register_collector(lambda: [
+    ('docgen_template_cache_hits_total', 'counter', 'Compiled template cache hits.', template_cache.hits),
+    ('docgen_template_cache_misses_total', 'counter', 'Compiled template cache misses.', template_cache.misses),
+    ('docgen_output_cache_hits_total', 'counter', 'Generated document cache hits.', output_cache.hits),
+    ('docgen_output_cache_misses_total', 'counter', 'Generated document cache misses.', output_cache.misses),
+    ('docgen_inflight_leaders_total', 'counter', 'Documents generated while holding the in-flight lock.', single_flight.leaders),
+    ('docgen_inflight_shared_total', 'counter', 'Requests answered with the result of an identical request in flight.', single_flight.shared),
+    ('docgen_admission_reserved_bytes', 'gauge', 'Estimated memory reserved by running renders.',
+     admission.light.reserved + admission.heavy.reserved),
+    ('docgen_admission_heavy_admitted_total', 'counter', 'Requests admitted to the heavy lane.', admission.heavy.admitted),
+    ('docgen_admission_rejected_total', 'counter', 'Requests refused by admission control.',
+     admission.light.rejected + admission.heavy.rejected),
+])
 
-    for_loops = re.findall(r'{%\s*for\b', template_content)
-    end_for_loops = re.findall(r'{%\s*endfor\b', template_content)
-    if len(for_loops) != len(end_for_loops):
-        raise ValueError("Incorrect or Missing'{% for %}' loop in template.")
+_image_cache = None
+_image_cache_lock = threading.Lock()
 
-def convert_to(folder, source, timeout=None):
-    args = [libreoffice_exec(), '--headless', '--convert-to', 'pdf', '--outdir', folder, source]
-    process = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
-    filename = re.search(r'-> (.*?) using filter', process.stdout.decode())
-    return filename.group(1) if filename else None
+def get_image_cache():
+    global _image_cache
+    with _image_cache_lock:
+        if _image_cache is None:
+            _image_cache = images.ImageCache(image_store)
+        return _image_cache
 
-def libreoffice_exec():
-    if sys.platform == 'darwin':  
-        return '/Applications/LibreOffice.app/Contents/MacOS/soffice'
-    elif sys.platform == 'win32': 
-        return r'C:\Program Files\LibreOffice\program\soffice.exe' 
-    return 'libreoffice'
+@app.before_request
+def start_request_timings():
+    g.timings = metrics.start_timings()
 
-def add_placeholders(doc, data, parent_key=None, processed_keys=None):
+def profile_token():
+    # Header only: a query parameter would end up in access logs.
+    return request.headers.get('X-Docgen-Profile')
+
+@app.before_request
+def start_profile():
     """
-    Recursively add placeholders to the DOCX document based on the JSON structure, avoiding duplicate keys.
+    Profile this /generate-docx call when it carries the DOC_PROFILE_TOKEN in the X-Docgen-Profile
+    header. The profile ID is returned in X-Docgen-Profile-Id.
     """
-    if processed_keys is None:
-        processed_keys = set() 
+    if request.endpoint != 'generate_docx' or not profile_token():
+        return None
+    if not profiling.authorized(profile_token()):
+        return jsonify({"error": "Profiling is not enabled or the token is wrong."}), 403
+    try:
+        g.profile = profiling.RequestProfile(f'{request.method} {request.full_path}').start()
+    except profiling.ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
+    return None
+
+@app.after_request
+def finish_profile(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        response.headers['X-Docgen-Profile-Id'] = profile.stop()
+    return response
 
-    if isinstance(data, dict):
-        if parent_key and parent_key not in processed_keys:
-            doc.add_paragraph(f'{{#{parent_key}}}')  
-            processed_keys.add(parent_key)
+@app.teardown_request
+def abandon_profile(exc):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.stop()
 
-        for key, value in data.items():
-            if key in processed_keys:
-                continue  
+@app.after_request
+def record_request_metrics(response):
+    timings = g.get('timings')
+    if timings:
+        response.headers['Server-Timing'] = metrics.server_timing(timings)
+    metrics.REQUESTS.inc(endpoint=request.endpoint or 'unknown', status=response.status_code)
+    return response
 
-            if isinstance(value, (dict, list)):  
-                add_placeholders(doc, value, key, processed_keys)
-            else:  # Primitive value
-                doc.add_paragraph(f'{{{key}}}')
-                processed_keys.add(key)
+def compile_template(template_bytes):
+    with stage('validate'):
+        validator.validate_template(BytesIO(template_bytes))
+    try:
+        with stage('compile'):
+            return render.CompiledTemplate(template_bytes)
+    except jinja2.TemplateSyntaxError:
+        raise ValueError("Missing 'endfor' in template")
+
+def load_template(template_bytes):
+    """
+    Return the compiled template for the given bytes, validating and compiling it only on a cache miss.
+    """
+    metrics.TEMPLATE_BYTES.observe(len(template_bytes))
+    return template_cache.get(template_bytes, compile_template)
 
-        if parent_key:
-            doc.add_paragraph(f'{{/{parent_key}}}')  
-    elif isinstance(data, list):
-        if parent_key and parent_key not in processed_keys:
-            doc.add_paragraph(f'{{#{parent_key}}}')  
-            processed_keys.add(parent_key)
+def load_stored_template(template_id):
+    """
+    Return the compiled template for a registered template ID; the file is only read on a cache miss.
+    """
+    stored = template_store.get(template_id)
+    metrics.TEMPLATE_BYTES.observe(stored.size)
+    return template_cache.get_keyed(stored.sha256, lambda: template_store.read(stored), compile_template)
 
-        for item in data:
-            add_placeholders(doc, item, None, processed_keys)
+def prune_requested(value):
+    """
+    Whether to prune data to the fields the template reads: the request's `prune` parameter
+    if given, DOC_PRUNE_DATA otherwise.
+    """
+    if value is None or value == '':
+        return PRUNE_DATA
+    return value in (True, '1', 'true')
 
-        if parent_key:
-            doc.add_paragraph(f'{{/{parent_key}}}')  
+def stream_render(compiled_template, data):
+    """
+    Whether to render the body in chunks: the data has a list of at least STREAM_RENDER_ROWS
+    items or streamed rows at the top level, and the template allows it.
+    """
+    if STREAM_RENDER_ROWS <= 0 or not compiled_template.streamable or not isinstance(data, dict):
+        return False
+    return any(isinstance(value, Iterator) or (isinstance(value, list) and len(value) >= STREAM_RENDER_ROWS)
+               for value in data.values())
 
-def generate_document(template_file, data, doc_type):
+def render_docx(compiled_template, data, path):
     """
-    Generate document based on the provided template or create a new one dynamically from JSON.
+    Render data into a compiled template and save the DOCX to path.
     """
-    if template_file:
-        validate_template(template_file)
-        template = DocxTemplate(template_file)
-        try:
+    template = render.CachedDocxTemplate(compiled_template, get_image_cache())
+    try:
+        if stream_render(compiled_template, data):
+            with stage('render'):
+                return template.render_streamed(data, path)
+        with stage('render'):
             template.render(data)
-        except jinja2.TemplateSyntaxError as e:
-            print("===========>85",e.message)
-            raise ValueError("Missing 'endfor' in template")
-        except jinja2.UndefinedError as e:
-            print("===========>87",e.message)
-            raise ValueError(f"Template error: Undefined variable encountered - {e.message}")
-
-        output = BytesIO()
-        template.save(output)
-        output.seek(0) 
+    except jinja2.UndefinedError as e:
+        raise ValueError(f"Template error: Undefined variable encountered - {e.message}")
+    with stage('save'):
+        template.save(path)
+    return path
+
+def convert_pdf(workdir, docx_path):
+    """
+    convert_to() timed as the 'convert' stage, counting failed conversions.
+    """
+    with stage('convert'):
+        try:
+            pdf_filename = convert_to(workdir, docx_path)
+        except Exception:
+            metrics.CONVERSION_FAILURES.inc()
+            raise
+    if not pdf_filename:
+        metrics.CONVERSION_FAILURES.inc()
+    return pdf_filename
+
+def docx_output(workdir, docx_path):
+    return docx_path
+
+def pdf_output(workdir, docx_path):
+    pdf_filename = convert_pdf(workdir, docx_path)
+    if not pdf_filename:
+        raise Exception("PDF conversion failed.")
+    return os.path.join(workdir, pdf_filename)
+
+# Every output format is derived from the rendered DOCX, so new ones (PDF/A, a PNG preview)
+# only need a function here and an entry in output_cache.MIMETYPES.
+OUTPUT_FORMATS = {'docx': docx_output, 'pdf': pdf_output}
+
+def derive_output(doc_type, workdir, docx_path):
+    """
+    Produce doc_type from the rendered DOCX; returns (path, mimetype, filename).
+    """
+    path = OUTPUT_FORMATS[doc_type](workdir, docx_path)
+    metrics.OUTPUT_BYTES.observe(os.path.getsize(path), doc_type=doc_type)
+    return path, MIMETYPES[doc_type], f'output.{doc_type}'
+
+def write_docx(compiled_template, data, workdir):
+    """
+    Render the template, or the placeholder skeleton without one, to workdir/output.docx.
+    """
+    docx_path = os.path.join(workdir, 'output.docx')
+    if compiled_template:
+        render_docx(compiled_template, data, docx_path)
     else:
-        doc = Document()
-        add_placeholders(doc, data)
-        output = BytesIO()
-        doc.save(output)
-        output.seek(0)
-
-    if doc_type.lower() == 'pdf':
-        with tempfile.NamedTemporaryFile(suffix=".docx", delete=False) as temp_docx_file:
-            temp_docx_file.write(output.getvalue())
-            temp_docx_path = temp_docx_file.name
-
-        with tempfile.TemporaryDirectory() as temp_dir:
-            pdf_filename = convert_to(temp_dir, temp_docx_path)
-            if pdf_filename:
-                pdf_path = os.path.join(temp_dir, pdf_filename)
-                with open(pdf_path, 'rb') as pdf_file:
-                    pdf_io = BytesIO(pdf_file.read())
-                pdf_io.seek(0)
-                return pdf_io, 'application/pdf', 'output.pdf'
+        with stage('skeleton'):
+            skeleton.write_skeleton(data, docx_path)
+    return docx_path
+
+def generate_document(compiled_template, data, doc_type, workdir):
+    """
+    Generate document based on the provided compiled template or create a new one dynamically from JSON.
+    The DOCX and any PDF are written into workdir and the path of the requested output is returned,
+    so the document is never held in memory as a whole.
+    """
+    docx_path = write_docx(compiled_template, data, workdir)
+    return derive_output(output_ext(doc_type), workdir, docx_path)
+
+def generate_cached(compiled_template, data, doc_type, key, cost, workdir):
+    """
+    Serve the document from the output cache, generating and caching it on a miss. Identical
+    requests arriving while it is generated wait for it rather than rendering it again.
+    Returns a path or, for memory-tier hits, a BytesIO. A key of None bypasses the cache.
+    Only the caller that renders reserves cost from the memory budget.
+    """
+    if not key:
+        with admission.admit(cost):
+            return generate_document(compiled_template, data, doc_type, workdir)
+    if output_cache.enabled:
+        cached = output_cache.get(key, doc_type)
+        if cached:
+            return cached
+
+    def generate(workdir):
+        with admission.admit(cost):
+            path, _, _ = generate_document(compiled_template, data, doc_type, workdir)
+        if output_cache.enabled:
+            output_cache.put_file(key, doc_type, path)
+        return path
+
+    ext = output_ext(doc_type)
+    return single_flight.do(key, ext, generate, workdir), MIMETYPES[ext], f'output.{ext}'
+
+def parse_doc_types(doc_type):
+    """
+    A list (or comma-separated string) of doc_types as a deduplicated list; None for a single one.
+    """
+    if isinstance(doc_type, str) and ',' not in doc_type:
+        return None
+    if isinstance(doc_type, str):
+        doc_type = doc_type.split(',')
+    if not isinstance(doc_type, list) or not doc_type:
+        raise ValueError("Document type must be a string or a list of strings.")
+    doc_types = []
+    for item in doc_type:
+        item = str(item).strip().lower()
+        if item not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported document type '{item}'.")
+        if item not in doc_types:
+            doc_types.append(item)
+    return doc_types
+
+def generate_formats(compiled_template, data, doc_types, keys, cost, workdir):
+    """
+    Render the DOCX once and derive every requested format from it, taking formats already in
+    the output cache from there. Returns [(filename, path or bytes, mimetype)]. cost is only
+    reserved if something has to be rendered.
+    """
+    outputs = {}
+    for doc_type in doc_types:
+        key = keys.get(doc_type) if keys else None
+        cached = output_cache.get(key, doc_type) if output_cache.enabled and key else None
+        if cached:
+            result, mimetype, filename = cached
+            outputs[doc_type] = (filename, result.getvalue() if hasattr(result, 'getvalue') else result, mimetype)
+    missing = [doc_type for doc_type in doc_types if doc_type not in outputs]
+    if missing:
+        with admission.admit(cost):
+            docx_path = write_docx(compiled_template, data, workdir)
+            for doc_type in missing:
+                path, mimetype, filename = derive_output(doc_type, workdir, docx_path)
+                key = keys.get(doc_type) if keys else None
+                if output_cache.enabled and key:
+                    output_cache.put_file(key, doc_type, path)
+                outputs[doc_type] = (filename, path, mimetype)
+    return [outputs[doc_type] for doc_type in doc_types]
+
+def generate_bundle(compiled_template, data, doc_types, keys, key, cost, workdir):
+    """
+    generate_formats() packed into workdir/output.zip, deduplicated on key like generate_cached().
+    """
+    def bundle(workdir):
+        outputs = generate_formats(compiled_template, data, doc_types, keys, cost, workdir)
+        zip_path = os.path.join(workdir, 'output.zip')
+        with open(zip_path, 'wb') as f:
+            for chunk in batch.stream_zip((filename, source) for filename, source, _ in outputs):
+                f.write(chunk)
+        return zip_path
+
+    path = single_flight.do(key, 'zip', bundle, workdir) if key else bundle(workdir)
+    return path, 'application/zip', 'output.zip'
+
+def weak_etag(key):
+    # Weak: the key identifies the inputs, and regenerating them may not give the same bytes
+    # (LibreOffice stamps the creation time into every PDF).
+    return f'W/"{key}"'
+
+def send_multipart(compiled_template, data, doc_types, keys, cost, etag=None):
+    """
+    Generate every format and stream them back as one multipart/mixed response.
+    """
+    workdir = scratch.mkdtemp()
+    try:
+        outputs = generate_formats(compiled_template, data, doc_types, keys, cost, workdir)
+    except BaseException:
+        scratch.remove(workdir)
+        raise
+    boundary = uuid.uuid4().hex
+
+    def body():
+        try:
+            yield from batch.stream_multipart(outputs, boundary)
+        finally:
+            scratch.remove(workdir)
+
+    headers = {'ETag': weak_etag(etag)} if etag else {}
+    return Response(body(), mimetype=f'multipart/mixed; boundary={boundary}', headers=headers)
+
+class AdmittedStream:
+    """
+    Response body iterating chunks under a memory reservation taken when it is created, so a
+    rejection is still answered with an error status. The reservation is released once the
+    body is exhausted or closed by the WSGI server.
+    """
+    def __init__(self, cost, chunks):
+        self._reservation = admission.admit(cost)
+        self._reservation.__enter__()
+        self._chunks = chunks
+
+    def __iter__(self):
+        try:
+            yield from self._chunks
+        finally:
+            self.close()
+
+    def close(self):
+        reservation, self._reservation = self._reservation, None
+        if reservation is not None:
+            if hasattr(self._chunks, 'close'):
+                self._chunks.close()
+            reservation.__exit__(None, None, None)
+
+def stream_data(stream, key):
+    """
+    Read NDJSON data whose first line is the data object and every further line one item of the
+    list `key`. The items are handed to the template as a one-pass iterator read from the stream
+    as the loop renders, so only one of them is in memory at a time.
+    """
+    records = batch.iter_records(stream)
+    data = next(records, None)
+    if not isinstance(data, dict):
+        raise ValueError("The first NDJSON line must be the data object.")
+    data[key] = records
+    return data
+
+class WorkdirFile(io.FileIO):
+    """
+    Read-only output file that removes its working directory when closed, i.e. once the
+    WSGI server has finished sending it. Being a real file, servers can send it with sendfile().
+    """
+    def __init__(self, path, workdir):
+        super().__init__(path, 'rb')
+        self.workdir = workdir
+
+    def close(self):
+        super().close()
+        scratch.remove(self.workdir)
+
+def send_generated(fn, *args, etag=None):
+    """
+    Run fn(*args, workdir) in a fresh working directory and stream its output file back.
+    The directory is removed once the response has been sent.
+    """
+    workdir = scratch.mkdtemp()
+    try:
+        result, mimetype, filename = fn(*args, workdir)
+        if isinstance(result, str) and os.path.dirname(result) == workdir:
+            result = WorkdirFile(result, workdir)
+        else:
+            scratch.remove(workdir)
+        response = send_file(result, as_attachment=True, download_name=filename, mimetype=mimetype, etag=False)
+        if etag:
+            response.headers['ETag'] = weak_etag(etag)
+        return response
+    except BaseException:
+        scratch.remove(workdir)
+        raise
+
+def prewarm_office(workdir):
+    """
+    Throwaway conversion of a one-line document that warms LibreOffice at boot.
+    """
+    path = skeleton.write_skeleton({'warmup': ''}, os.path.join(workdir, 'warmup.docx'))
+    if not office.prewarm(workdir, path):
+        raise Exception("PDF conversion failed.")
+
+warmup = Warmup([batch, images, render, skeleton, validator], prewarm_office if PREWARM_OFFICE else None)
+
+def is_json_mimetype(mimetype):
+    return mimetype == 'application/json' or (mimetype.startswith('application/') and mimetype.endswith('+json'))
+
+class GenerateRequest:
+    """
+    A /generate-docx request worked out from plain values, shared by the Flask and ASGI handlers.
+    json_body is the raw body of a JSON request, template_bytes an uploaded template file,
+    data_file an uploaded data file and body the body stream of an NDJSON request; fields and
+    query are the form fields and query string, accept and if_none_match the parsed headers.
+    The result says how to answer: not_modified (304), is_async (queue fn), multipart, or
+    fn(*args, workdir) generating the document, which reserves cost from the memory budget only
+    if it has to render. Raises ValueError for bad requests.
+    """
+    def __init__(self, mimetype, fields, query, accept, if_none_match, json_body=None, template_bytes=None,
+                 data_file=None, body=None):
+        self.compiled_template = None
+        json_data = None
+
+        if template_bytes is not None:
+            self.compiled_template = load_template(template_bytes)
+        elif json_body is not None:
+            with stage('data'):
+                json_data = fastjson.loads(json_body)
+            base64_template = json_data.get('template')
+            if base64_template:
+                with stage('decode'):
+                    template_bytes = base64.b64decode(base64_template)
+                self.compiled_template = load_template(template_bytes)
+
+        def param(name):
+            if json_data:
+                return json_data.get(name)
+            return fields.get(name) or query.get(name)
+
+        template_id = param('template_id')
+        if self.compiled_template is None and template_id:
+            self.compiled_template = load_stored_template(template_id)
+        compiled_template = self.compiled_template
+
+        stream_key = fields.get('stream') or query.get('stream')
+        self.streamed = mimetype == 'application/x-ndjson' or bool(data_file is not None and stream_key)
+        if mimetype == 'application/x-ndjson':
+            data = stream_data(body, stream_key or 'rows')
+        elif self.streamed:
+            data = stream_data(data_file, stream_key)
+        elif data_file is not None:
+            with stage('data'):
+                data = fastjson.loads(data_file.read())
+        elif json_data and 'data' in json_data:
+            data = json_data['data']
+        elif 'data' in fields:
+            with stage('data'):
+                data = fastjson.loads(fields['data'])
+        else:
+            raise ValueError("JSON data (either as file or raw JSON in form data) is required.")
+
+        doc_type = param('doc_type')
+        if not doc_type:
+            raise ValueError("Document type is required.")
+        doc_types = parse_doc_types(doc_type)
+        self.doc_types = doc_types
+        self.multipart = bool(doc_types) and accept.best == 'multipart/mixed'
+        self.is_async = query.get('async') in ('1', 'true')
+        self.not_modified = False
+        template_bytes = len(compiled_template.data) if compiled_template else 0
+        if compiled_template and prune_requested(param('prune')):
+            with stage('prune'):
+                data = compiled_template.schema.prune(data)
+        self.data = data
+
+        if self.streamed:
+            # Streamed rows can only be read once, while the request is open: no cache, no async.
+            if compiled_template is None:
+                raise ValueError("Streamed data requires a template.")
+            if self.is_async:
+                raise ValueError("Streamed data cannot be rendered asynchronously.")
+            # Rows are rendered in chunks as they arrive, so only the template counts.
+            self.cost = estimate_cost(template_bytes, 0, 0)
+            self.key = self.keys = None
+            if doc_types:
+                self.fn, self.args = generate_bundle, (compiled_template, data, doc_types, None, None, self.cost)
             else:
-                raise Exception("PDF conversion failed.")
-    else:
-        return output, 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'output.docx'
+                self.fn, self.args = generate_cached, (compiled_template, data, doc_type, None, self.cost)
+            return
+
+        with stage('hash'):
+            data_json = canonical_json(data)
+            metrics.DATA_BYTES.observe(len(data_json))
+            if images.STORED_KEY.encode() in data_json:
+                # Registered images may get new versions, so the key covers what they resolve to.
+                data_json += ','.join(image_store.get(i).sha256 for i in images.stored_image_ids(data)).encode()
+            template_sha256 = compiled_template.sha256 if compiled_template else None
+            if doc_types:
+                # Each format is cached under its own key; the response is identified by all of them
+                # and by its packaging, since a ZIP and a multipart body are different bytes.
+                self.keys = {t: output_key(template_sha256, data_json, t) for t in doc_types}
+                packaging = 'multipart' if self.multipart else 'zip'
+                self.key = hashlib.sha256(f"{','.join(self.keys.values())};{packaging}".encode()).hexdigest()
+            else:
+                self.keys = None
+                self.key = output_key(template_sha256, data_json, doc_type)
+        # If-None-Match uses the weak comparison, and the ETags sent are weak.
+        if if_none_match.contains_weak(self.key):
+            self.not_modified = True
+            return
+        self.cost = estimate_cost(template_bytes, len(data_json), count_items(data))
+
+        if doc_types:
+            self.fn, self.args = generate_bundle, (compiled_template, data, doc_types, self.keys, self.key, self.cost)
+        else:
+            self.fn, self.args = generate_cached, (compiled_template, data, doc_type, self.key, self.cost)
 
 @app.route('/generate-docx', methods=['POST'])
 def generate_docx():
     try:
-        template_file = None
+        template_file = request.files.get('template')
+        data_file = request.files.get('data')
+        req = GenerateRequest(
+            request.mimetype, request.form, request.args, request.accept_mimetypes, request.if_none_match,
+            json_body=request.get_data() if template_file is None and request.is_json else None,
+            template_bytes=template_file.read() if template_file is not None else None,
+            data_file=data_file.stream if data_file is not None else None,
+            body=request.stream if request.mimetype == 'application/x-ndjson' else None)
+
+        # Bundles are a ZIP or multipart/mixed depending on Accept.
+        headers = {'Vary': 'Accept'} if req.doc_types else {}
+        if req.not_modified:
+            return '', 304, {'ETag': weak_etag(req.key), **headers}
+        if req.is_async:
+            job = job_queue.submit(req.fn, *req.args)
+            return jsonify({"job_id": job['id'], "status": job['status']}), 202, {'Location': f"/jobs/{job['id']}"}
+
+        if req.multipart:
+            response = send_multipart(req.compiled_template, req.data, req.doc_types, req.keys, req.cost, etag=req.key)
+        else:
+            response = send_generated(req.fn, *req.args, etag=req.key)
+        response.headers.update(headers)
+        return response
+
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': '5'}
+    except ConversionBusy as e:
+        return jsonify({"error": str(e)}), e.status, {'Retry-After': str(e.retry_after)}
+    except AdmissionRejected as e:
+        return jsonify({"error": str(e)}), e.status, {'Retry-After': str(e.retry_after)} if e.retry_after else {}
+    except ImageNotFound as e:
+        return jsonify({"error": f"Image '{e.args[0]}' not found."}), 404
+    except TemplateNotFound as e:
+        return jsonify({"error": f"Template '{e.args[0]}' not found."}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def batch_entries(compiled_template, records, doc_type):
+    """
+    Yield (name, path or bytes) ZIP entries for every record. PDFs are converted in chunks of
+    BATCH_CONVERT_SIZE files per LibreOffice invocation. A record that fails for any reason is
+    counted and listed in errors.json; the others are still returned.
+    """
+    errors = []
+    records = enumerate(records, 1)
+    while True:
+        try:
+            chunk = list(itertools.islice(records, BATCH_CONVERT_SIZE if doc_type == 'pdf' else 1))
+        except ValueError as e:
+            errors.append({"error": str(e)})
+            break
+        if not chunk:
+            break
+        with scratch.workdir(admit=False) as temp_dir:
+            sources = {}
+            for index, record in chunk:
+                path = os.path.join(temp_dir, f'{index:06d}.docx')
+                try:
+                    render_docx(compiled_template, record, path)
+                except Exception as e:
+                    metrics.BATCH_RECORD_FAILURES.inc(stage='render')
+                    errors.append({"record": index, "error": str(e)})
+                    continue
+                if doc_type != 'pdf':
+                    yield os.path.basename(path), path
+                    continue
+                sources[path] = index
+
+            if sources:
+                try:
+                    with stage('convert'):
+                        converted = convert_many(temp_dir, list(sources))
+                except Exception as e:
+                    metrics.BATCH_RECORD_FAILURES.inc(len(sources), stage='convert')
+                    errors.extend({"record": index, "error": str(e)} for index in sources.values())
+                    continue
+                for path, pdf_filename in converted.items():
+                    if isinstance(pdf_filename, Exception):
+                        metrics.CONVERSION_FAILURES.inc()
+                        metrics.BATCH_RECORD_FAILURES.inc(stage='convert')
+                        errors.append({"record": sources[path], "error": str(pdf_filename)})
+                        continue
+                    yield f'{sources[path]:06d}.pdf', os.path.join(temp_dir, pdf_filename)
+    if errors:
+        yield 'errors.json', json.dumps(errors).encode()
+
+def generate_merged(compiled_template, records, doc_type, workdir):
+    """
+    Render every record, merge them into one DOCX and convert the merged document once if PDF is requested.
+    """
+    paths = []
+    for index, record in enumerate(records, 1):
+        paths.append(render_docx(compiled_template, record, os.path.join(workdir, f'{index:06d}.docx')))
+    with stage('merge'):
+        merged_path = batch.merge_documents(paths, os.path.join(workdir, 'merged.docx'))
+    return derive_output(output_ext(doc_type), workdir, merged_path)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Return the job status while it is queued or running, the document once it is done,
+    or the error it failed with.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found."}), 404
+    if job['status'] == 'failed':
+        headers = {'Retry-After': str(job['retry_after'])} if job.get('retry_after') else {}
+        return jsonify({"job_id": job_id, "status": job['status'], "error": job['error']}), job['code'], headers
+    if job['status'] != 'done':
+        return jsonify({"job_id": job_id, "status": job['status']}), 202, {'Retry-After': '1'}
+    try:
+        return send_file(job_queue.result_path(job), as_attachment=True,
+                         download_name=job['filename'], mimetype=job['mimetype'])
+    except FileNotFoundError:
+        return jsonify({"error": f"Job '{job_id}' not found."}), 404
+
+@app.route('/generate-batch', methods=['POST'])
+def generate_batch():
+    """
+    Render one template against many records. Records come as a JSON array in `records`, as a
+    JSON array or NDJSON `records` file, or as an application/x-ndjson request body (with the
+    other parameters in the query string). Returns a streamed ZIP (output=zip, the default) or
+    one merged document (output=merged).
+    """
+    try:
+        compiled_template = None
         json_data = None
 
         if 'template' in request.files:
-            template_file = request.files['template']
-            print("template_file",template_file)
+            compiled_template = load_template(request.files['template'].read())
         elif request.is_json:
-            json_data = request.get_json()
+            with stage('data'):
+                json_data = request.get_json()
             base64_template = json_data.get('template')
             if base64_template:
-                template_bytes = base64.b64decode(base64_template)
-                template_file = BytesIO(template_bytes)
+                with stage('decode'):
+                    template_bytes = base64.b64decode(base64_template)
+                compiled_template = load_template(template_bytes)
 
-        if 'data' in request.files:
-            json_data_file = request.files['data']
-            data = json.load(json_data_file)
-        elif json_data and 'data' in json_data:
-            data = json_data['data']
-        elif 'data' in request.form:
-            data = json.loads(request.form['data'])
+        def param(name):
+            if json_data and name in json_data:
+                return json_data[name]
+            return request.form.get(name) or request.args.get(name)
+
+        template_id = param('template_id')
+        if compiled_template is None and template_id:
+            compiled_template = load_stored_template(template_id)
+        if compiled_template is None:
+            return jsonify({"error": "Template (file, base64 or template_id) is required."}), 400
+
+        if json_data and 'records' in json_data:
+            records = json_data['records']
+            if not isinstance(records, list):
+                return jsonify({"error": "Records must be a JSON array."}), 400
+        elif 'records' in request.files:
+            records = batch.iter_records(request.files['records'].stream)
+        elif 'records' in request.form:
+            records = batch.iter_records(BytesIO(request.form['records'].encode()))
+        elif request.mimetype == 'application/x-ndjson':
+            records = batch.iter_records(request.stream)
         else:
-            return jsonify({"error": "JSON data (either as file or raw JSON in form data) is required."}), 400
+            return jsonify({"error": "Records (JSON array or NDJSON) are required."}), 400
 
-        doc_type = request.form.get('doc_type') if not request.is_json else json_data.get('doc_type')
+        doc_type = param('doc_type')
         if not doc_type:
             return jsonify({"error": "Document type is required."}), 400
+        doc_type = doc_type.lower()
+        if prune_requested(param('prune')):
+            records = map(compiled_template.schema.prune, records)
+
+        if (param('output') or 'zip') == 'merged':
+            # Every record ends up in one document: the whole upload counts.
+            items = count_items(records) if isinstance(records, list) else 0
+            with admission.admit(estimate_cost(len(compiled_template.data), request.content_length or 0, items)):
+                return send_generated(generate_merged, compiled_template, records, doc_type)
+
+        # Records are rendered one at a time, so only the template counts. Scratch space is checked
+        # once here: a chunk failing on it halfway through would only leave the ZIP short.
+        scratch.check()
+        body = stream_with_context(batch.stream_zip(batch_entries(compiled_template, records, doc_type)))
+        body = AdmittedStream(estimate_cost(len(compiled_template.data), 0, 0), body)
+        return Response(body, mimetype='application/zip',
+                        headers={'Content-Disposition': 'attachment; filename=output.zip'})
+
+    except ConversionBusy as e:
+        return jsonify({"error": str(e)}), e.status, {'Retry-After': str(e.retry_after)}
+    except AdmissionRejected as e:
+        return jsonify({"error": str(e)}), e.status, {'Retry-After': str(e.retry_after)} if e.retry_after else {}
+    except ImageNotFound as e:
+        return jsonify({"error": f"Image '{e.args[0]}' not found."}), 404
+    except TemplateNotFound as e:
+        return jsonify({"error": f"Template '{e.args[0]}' not found."}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def template_upload():
+    """
+    Template bytes and optional name from a multipart `template` file or base64 `template` in
+    JSON; (None, None) if the request has neither.
+    """
+    if 'template' in request.files:
+        return request.files['template'].read(), request.form.get('name')
+    if request.is_json and request.get_json().get('template'):
+        json_data = request.get_json()
+        with stage('decode'):
+            return base64.b64decode(json_data['template']), json_data.get('name')
+    return None, None
+
+@app.route('/templates', methods=['POST'])
+def upload_template():
+    try:
+        template_bytes, name = template_upload()
+        if template_bytes is None:
+            return jsonify({"error": "Template (either as file or base64 in JSON) is required."}), 400
+
+        compiled_template = load_template(template_bytes)
+        stored = template_store.put(compiled_template.data, name)
+        return jsonify(stored.to_dict()), 201
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        file_io, mimetype, filename = generate_document(template_file, data, doc_type)
-        return send_file(file_io, as_attachment=True, download_name=filename, mimetype=mimetype)
+@app.route('/templates', methods=['GET'])
+def list_templates():
+    return jsonify({"templates": [t.to_dict() for t in template_store.list()]})
+
+@app.route('/templates/variables', methods=['POST'])
+def inspect_template():
+    """
+    Variables, fields and loops of an uploaded template (as for POST /templates), without
+    registering it.
+    """
+    try:
+        template_bytes, _ = template_upload()
+        if template_bytes is None:
+            return jsonify({"error": "Template (either as file or base64 in JSON) is required."}), 400
+        compiled_template = load_template(template_bytes)
+        return jsonify(dict(compiled_template.schema.to_dict(), sha256=compiled_template.sha256))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
+@app.route('/templates/<template_id>/variables', methods=['GET'])
+def template_variables(template_id):
+    try:
+        compiled_template = load_stored_template(template_id)
+        return jsonify(dict(compiled_template.schema.to_dict(), template_id=template_id,
+                            sha256=compiled_template.sha256))
+    except TemplateNotFound:
+        return jsonify({"error": f"Template '{template_id}' not found."}), 404
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/templates/<template_id>', methods=['DELETE'])
+def delete_template(template_id):
+    try:
+        deleted = template_store.delete(template_id)
+        return jsonify({"deleted": [t.to_dict() for t in deleted]})
+    except TemplateNotFound:
+        return jsonify({"error": f"Template '{template_id}' not found."}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+def image_dict(stored):
+    return {'image_id': stored.template_id, 'name': stored.name, 'version': stored.version,
+            'sha256': stored.sha256, 'size': stored.size}
+
+@app.route('/images', methods=['POST'])
+def upload_image():
+    """
+    Register an image (multipart `image` file or base64 `image` in JSON, optional `name`) for use
+    as {"$image_id": ...} in data.
+    """
+    try:
+        if 'image' in request.files:
+            image_bytes = request.files['image'].read()
+            name = request.form.get('name')
+        elif request.is_json and request.get_json().get('image'):
+            json_data = request.get_json()
+            with stage('decode'):
+                image_bytes = base64.b64decode(json_data['image'])
+            name = json_data.get('name')
+        else:
+            return jsonify({"error": "Image (either as file or base64 in JSON) is required."}), 400
+
+        images.parse_image(image_bytes)
+        stored = image_store.put(image_bytes, name)
+        return jsonify(image_dict(stored)), 201
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/images', methods=['GET'])
+def list_images():
+    return jsonify({"images": [image_dict(t) for t in image_store.list()]})
+
+@app.route('/images/<image_id>', methods=['DELETE'])
+def delete_image(image_id):
+    try:
+        deleted = image_store.delete(image_id)
+        return jsonify({"deleted": [image_dict(t) for t in deleted]})
+    except ImageNotFound:
+        return jsonify({"error": f"Image '{image_id}' not found."}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness probe: 503 until the heavy imports and the LibreOffice warm-up are done.
+    Starts the warm-up if the server did not.
+    """
+    warmup.start()
+    if not warmup.ready:
+        return jsonify(warmup.status()), 503, {'Retry-After': '1'}
+    return jsonify(warmup.status())
+
+@app.route('/profiles', methods=['GET'])
+def list_profiles():
+    if not profiling.authorized(profile_token()):
+        return jsonify({"error": "Profiling is not enabled or the token is wrong."}), 403
+    return jsonify({"profiles": [{"profile_id": profile_id,
+                                  "files": {ext: f"/profiles/{profile_id}/{ext}" for ext in profiling.PROFILE_FILES}}
+                                 for profile_id in profiling.list_profiles()]})
+
+@app.route('/profiles/<profile_id>/<kind>', methods=['GET'])
+def download_profile(profile_id, kind):
+    if not profiling.authorized(profile_token()):
+        return jsonify({"error": "Profiling is not enabled or the token is wrong."}), 403
+    path = profiling.profile_path(profile_id, kind)
+    if path is None:
+        return jsonify({"error": f"Profile '{profile_id}' has no '{kind}' file."}), 404
+    return send_file(path, as_attachment=True, download_name=f'{profile_id}.{kind}',
+                     mimetype=profiling.PROFILE_FILES[kind])
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.expose(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({"templates": template_cache.stats(), "outputs": output_cache.stats(),
+                    "images": get_image_cache().stats(), "inflight": single_flight.stats(),
+                    "admission": admission.stats(), "scratch": scratch.stats()})
+
 if __name__ == '__main__':
+    # With the reloader, only the child process that serves requests warms up.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        scratch.sweep()
+        job_queue.sweep()
+        warmup.start()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,230 @@
+"""
+asyncio entry point: POST /generate-docx is served natively, every other route by the Flask app.
+
+    python3 asgi.py          (or: uvicorn asgi:app)
+
+Uploads and downloads are streamed by the event loop, so requests waiting for their upload or
+for the client to read the document hold a coroutine rather than a thread. Generating the
+document runs as one call on a pool of DOC_ASGI_THREADS threads, and that call includes every
+wait inside it: for a conversion slot or batch, for an identical request's single-flight
+result, for admission and for LibreOffice itself. Requests in those waits still hold a thread,
+so a process generates at most DOC_ASGI_THREADS documents at once, like the thread server. At
+most DOC_ASGI_MAX_QUEUED more calls wait for a thread; past that the request is answered 503
+with Retry-After. The request contract is the same as the Flask endpoint's, except that the
+X-Docgen-Profile hook is not available here.
+"""
+import io
+import os
+import asyncio
+import contextvars
+import threading
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.datastructures import UploadFile
+from starlette.exceptions import HTTPException
+from starlette.formparsers import MultiPartParser
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags, parse_options_header
+
+import app as flask_app
+import metrics
+from admission import AdmissionRejected
+from jobs import QueueFull
+from office import ConversionBusy
+from template_store import TemplateNotFound, ImageNotFound
+
+BIND = os.environ.get('DOC_BIND', '0.0.0.0:5000')
+WORKERS = int(os.environ.get('DOC_WORKERS', str(os.cpu_count() or 1)))
+THREADS = int(os.environ.get('DOC_ASGI_THREADS', str(4 * (os.cpu_count() or 1))))
+MAX_FIELD_BYTES = int(os.environ.get('DOC_ASGI_MAX_FIELD_BYTES', str(64 * 1024 * 1024)))
+MAX_QUEUED = int(os.environ.get('DOC_ASGI_MAX_QUEUED', str(4 * THREADS)))
+
+# Form fields such as `data` may be far larger than Starlette's 1 MiB default; Flask has no limit.
+MultiPartParser.max_part_size = MAX_FIELD_BYTES
+
+executor = ThreadPoolExecutor(THREADS, thread_name_prefix='doc-asgi')
+
+class ExecutorBusy(Exception):
+    pass
+
+_queued = 0
+_queued_lock = threading.Lock()
+
+def _dequeue(started):
+    global _queued
+    with _queued_lock:
+        if not started:
+            started.append(True)
+            _queued -= 1
+
+async def run_sync(fn, *args):
+    """
+    Run fn(*args) on the executor in a copy of the current context, so stage timings recorded
+    there land in this request's Server-Timing header. Calls waiting for a thread are bounded by
+    MAX_QUEUED: past that ExecutorBusy is raised at once instead of queueing without limit.
+    """
+    global _queued
+    with _queued_lock:
+        if _queued >= MAX_QUEUED:
+            raise ExecutorBusy("Server is busy, retry later.")
+        _queued += 1
+    ctx = contextvars.copy_context()
+    started = []
+
+    def call():
+        _dequeue(started)
+        return ctx.run(fn, *args)
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, call)
+    finally:
+        # Cancelled before a thread picked it up.
+        _dequeue(started)
+
+class BodyReader(io.RawIOBase):
+    """
+    Blocking file object over the request body for code running on the executor: every read
+    waits for the event loop to receive the next chunk.
+    """
+    def __init__(self, request, loop):
+        self._chunks = request.stream().__aiter__()
+        self._loop = loop
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = asyncio.run_coroutine_threadsafe(self._chunks.__anext__(), self._loop).result()
+            except StopAsyncIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+def error_response(e):
+    if isinstance(e, (QueueFull, ExecutorBusy)):
+        return JSONResponse({"error": str(e)}, 503, {'Retry-After': '5'})
+    if isinstance(e, ConversionBusy):
+        return JSONResponse({"error": str(e)}, e.status, {'Retry-After': str(e.retry_after)})
+    if isinstance(e, AdmissionRejected):
+        return JSONResponse({"error": str(e)}, e.status, {'Retry-After': str(e.retry_after)} if e.retry_after else {})
+    if isinstance(e, ImageNotFound):
+        return JSONResponse({"error": f"Image '{e.args[0]}' not found."}, 404)
+    if isinstance(e, TemplateNotFound):
+        return JSONResponse({"error": f"Template '{e.args[0]}' not found."}, 404)
+    if isinstance(e, ValueError):
+        return JSONResponse({"error": str(e)}, 400)
+    if isinstance(e, HTTPException):
+        return JSONResponse({"error": e.detail}, e.status_code)
+    return JSONResponse({"error": str(e)}, 500)
+
+async def send_generated(fn, *args, etag=None):
+    """
+    Async counterpart of app.send_generated(): fn(*args, workdir) runs on the executor and its
+    output is streamed back, removing the working directory afterwards.
+    """
+    workdir = flask_app.scratch.mkdtemp()
+    try:
+        result, mimetype, filename = await run_sync(fn, *args, workdir)
+    except BaseException:
+        flask_app.scratch.remove(workdir)
+        raise
+    headers = {'ETag': flask_app.weak_etag(etag)} if etag else {}
+    cleanup = BackgroundTask(flask_app.scratch.remove, workdir)
+    if isinstance(result, str):
+        return FileResponse(result, media_type=mimetype, filename=filename, headers=headers, background=cleanup)
+    headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return Response(result.getvalue(), media_type=mimetype, headers=headers, background=cleanup)
+
+async def send_multipart(cost, compiled_template, data, doc_types, keys, etag=None):
+    workdir = flask_app.scratch.mkdtemp()
+    try:
+        outputs = await run_sync(flask_app.generate_formats, compiled_template, data, doc_types, keys, cost, workdir)
+    except BaseException:
+        flask_app.scratch.remove(workdir)
+        raise
+    boundary = os.urandom(16).hex()
+    headers = {'ETag': flask_app.weak_etag(etag)} if etag else {}
+    return StreamingResponse(flask_app.batch.stream_multipart(outputs, boundary),
+                             media_type=f'multipart/mixed; boundary={boundary}', headers=headers,
+                             background=BackgroundTask(flask_app.scratch.remove, workdir))
+
+async def generate_docx(request):
+    timings = metrics.start_timings()
+    try:
+        response = await _generate_docx(request)
+    except Exception as e:
+        response = error_response(e)
+    if timings:
+        response.headers['Server-Timing'] = metrics.server_timing(timings)
+    metrics.REQUESTS.inc(endpoint='generate_docx', status=response.status_code)
+    return response
+
+async def _generate_docx(request):
+    mimetype, _ = parse_options_header(request.headers.get('content-type', ''))
+    is_form = mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded')
+    form = await request.form() if is_form else {}
+    files = {name: value for name, value in form.items() if isinstance(value, UploadFile)}
+    fields = {name: value for name, value in form.items() if not isinstance(value, UploadFile)}
+    template_bytes = await files['template'].read() if 'template' in files else None
+    json_body = None
+    if template_bytes is None and flask_app.is_json_mimetype(mimetype):
+        json_body = await request.body()
+    body = None
+    if mimetype == 'application/x-ndjson':
+        body = io.BufferedReader(BodyReader(request, asyncio.get_running_loop()))
+
+    req = await run_sync(flask_app.GenerateRequest, mimetype, fields, request.query_params,
+                         parse_accept_header(request.headers.get('accept'), MIMEAccept),
+                         parse_etags(request.headers.get('if-none-match')), json_body, template_bytes,
+                         files['data'].file if 'data' in files else None, body)
+
+    headers = {'Vary': 'Accept'} if req.doc_types else {}
+    if req.not_modified:
+        return Response(status_code=304, headers={'ETag': flask_app.weak_etag(req.key), **headers})
+    if req.is_async:
+        job = flask_app.job_queue.submit(req.fn, *req.args)
+        return JSONResponse({"job_id": job['id'], "status": job['status']}, 202, {'Location': f"/jobs/{job['id']}"})
+    if req.multipart:
+        response = await send_multipart(req.cost, req.compiled_template, req.data, req.doc_types, req.keys, etag=req.key)
+    else:
+        response = await send_generated(req.fn, *req.args, etag=req.key)
+    response.headers.update(headers)
+    return response
+
+@asynccontextmanager
+async def lifespan(app):
+    flask_app.scratch.sweep()
+    flask_app.job_queue.sweep()
+    flask_app.warmup.start()
+    yield
+
+app = Starlette(
+    routes=[
+        Route('/generate-docx', generate_docx, methods=['POST']),
+        Mount('/', WSGIMiddleware(flask_app.app)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan,
+)
+
+def main():
+    import uvicorn
+    host, _, port = BIND.rpartition(':')
+    uvicorn.run('asgi:app', host=host or '0.0.0.0', port=int(port), workers=WORKERS,
+                timeout_keep_alive=30, access_log=True)
+
+if __name__ == '__main__':
+    main()
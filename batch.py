@@ -0,0 +1,120 @@
+import json
+import zipfile
+
+from docx import Document
+from docxcompose.composer import Composer
+
+import fastjson
+
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+def iter_records(stream):
+    """
+    Yield records from a binary stream holding either a JSON array or NDJSON (one object per line).
+    NDJSON is read line by line, so only one record is held in memory at a time.
+    """
+    first = b''
+    while not first:
+        line = stream.readline()
+        if not line:
+            return
+        first = line.strip()
+
+    if first.startswith(b'['):
+        records = fastjson.loads(first + stream.read())
+        if not isinstance(records, list):
+            raise ValueError("Records must be a JSON array or NDJSON.")
+        yield from records
+        return
+
+    line = first
+    lineno = 1
+    while True:
+        line = line.strip()
+        if line:
+            try:
+                yield fastjson.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid NDJSON record on line {lineno}: {e.msg}")
+        line = stream.readline()
+        if not line:
+            return
+        lineno += 1
+
+class _ZipSink:
+    """
+    Write-only file object that collects what zipfile writes so it can be yielded as response chunks.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+def stream_zip(entries, chunk_size=ZIP_CHUNK_SIZE):
+    """
+    Yield a ZIP archive chunk by chunk from an iterable of (name, path or bytes) entries.
+    Files are copied into the archive in chunk_size pieces, so no entry is held in memory whole.
+    Entries are stored uncompressed since DOCX and PDF payloads are already compressed.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+        for name, source in entries:
+            if isinstance(source, bytes):
+                archive.writestr(name, source)
+                yield from sink.drain()
+                continue
+            with open(source, 'rb') as src, archive.open(name, 'w', force_zip64=True) as dest:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
+
+def stream_multipart(entries, boundary, chunk_size=ZIP_CHUNK_SIZE):
+    """
+    Yield a multipart/mixed body from an iterable of (name, path or bytes, mimetype) entries,
+    one part per entry, copying files in chunk_size pieces.
+    """
+    for name, source, mimetype in entries:
+        yield (f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+               f'Content-Disposition: attachment; filename="{name}"\r\n\r\n').encode()
+        if isinstance(source, bytes):
+            yield source
+        else:
+            with open(source, 'rb') as src:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+def merge_documents(docx_files, output_path):
+    """
+    Merge DOCX files (paths or file objects) into one document at output_path, each starting on a new page.
+    """
+    composer = None
+    for docx_file in docx_files:
+        doc = Document(docx_file)
+        if composer is None:
+            composer = Composer(doc)
+            continue
+        composer.doc.add_page_break()
+        composer.append(doc)
+    if composer is None:
+        raise ValueError("At least one record is required.")
+    composer.save(output_path)
+    return output_path
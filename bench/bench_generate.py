@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Benchmark /generate-docx in-process across template sizes, loop sizes, output types and input
+encodings. Reports throughput, p50/p95/p99 latency, time per pipeline stage and peak memory.
+Each scenario runs in a fresh subprocess, so its peak RSS is not inherited from earlier ones.
+
+    python bench/bench_generate.py --rows 10,1000,100000 --doc-types docx,pdf --json bench.json
+
+PDF scenarios use bench/soffice_stub.py unless --real-soffice is given, so no LibreOffice is
+needed. The output cache is disabled and every request carries its own number in `data`, so
+every request does the full work.
+"""
+import os
+import sys
+import json
+import math
+import time
+import base64
+import struct
+import random
+import argparse
+import itertools
+import tempfile
+import resource
+import threading
+import subprocess
+from io import BytesIO
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB = os.path.join(ROOT, 'bench', 'soffice_stub.py')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def make_template(size):
+    """
+    Build a statement template: a greeting, a paragraph loop and a table row loop. The large
+    variant adds a 1.4 MB image and 2000 filler paragraphs.
+    """
+    from docx import Document
+    doc = Document()
+    doc.add_heading('Statement for {{ name }}', 1)
+    doc.add_paragraph('{% for note in notes %}')
+    doc.add_paragraph('Note: {{ note }}')
+    doc.add_paragraph('{% endfor %}')
+    table = doc.add_table(rows=3, cols=3)
+    table.cell(0, 0).text = '{%tr for row in rows %}'
+    table.cell(1, 0).text = '{{ row.id }}'
+    table.cell(1, 1).text = '{{ row.label }}'
+    table.cell(1, 2).text = '{{ row.amount }}'
+    table.cell(2, 0).text = '{%tr endfor %}'
+    doc.sections[0].header.paragraphs[0].text = 'Account {{ account }}'
+    if size == 'large':
+        rng = random.Random(0)
+        width, height = 800, 600
+        pixels = bytes(rng.getrandbits(8) for _ in range(width * height * 3))
+        header = b'BM' + struct.pack('<IHHI', 54 + len(pixels), 0, 0, 54)
+        header += struct.pack('<IiiHHIIiiII', 40, width, height, 1, 24, 0, len(pixels), 2835, 2835, 0, 0)
+        doc.add_picture(BytesIO(header + pixels))
+        for i in range(2000):
+            doc.add_paragraph(f'Clause {i}: the holder {{{{ name }}}} agrees to the terms set out above.')
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+def make_data(rows):
+    return {
+        'name': 'Jane Doe',
+        'account': '0001-2345',
+        'notes': ['Paid on time', 'Limit increased'],
+        'rows': [{'id': i, 'label': f'Transaction {i}', 'amount': f'{i * 1.25:.2f}'} for i in range(rows)],
+    }
+
+def current_rss():
+    """
+    Resident set size of this process in bytes, from /proc/self/statm; None where it is missing.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return None
+
+class StageMemory:
+    """
+    Wraps pipeline functions to record the peak RSS seen while each stage runs, sampled from
+    /proc/self/statm every `interval` seconds. Unlike tracemalloc this includes memory allocated
+    by C libraries such as libxml2. With concurrent requests the stages overlap, so a peak is the
+    process-wide RSS during the stage, not the stage's own share. Stage times come from the
+    Server-Timing header instead, which covers every stage the app records.
+    """
+    def __init__(self, enabled, interval=0.002):
+        self.enabled = enabled and current_rss() is not None
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.peaks = defaultdict(int)
+        self._windows = {}
+        if self.enabled:
+            threading.Thread(target=self._sample, daemon=True).start()
+
+    def _sample(self):
+        while True:
+            rss = current_rss()
+            with self.lock:
+                for window, peak in self._windows.items():
+                    if rss > peak:
+                        self._windows[window] = rss
+            time.sleep(self.interval)
+
+    def wrap(self, owner, attr, stage):
+        original = getattr(owner, attr)
+
+        def sampled(*args, **kwargs):
+            window = object()
+            with self.lock:
+                self._windows[window] = current_rss()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                rss = current_rss()
+                with self.lock:
+                    peak = max(self._windows.pop(window), rss)
+                    self.peaks[stage] = max(self.peaks[stage], peak)
+
+        if self.enabled:
+            setattr(owner, attr, sampled)
+
+    def reset(self):
+        with self.lock:
+            self.peaks.clear()
+
+def parse_server_timing(header):
+    """
+    {stage: milliseconds} from a Server-Timing header value.
+    """
+    stages = {}
+    for entry in filter(None, (part.strip() for part in (header or '').split(','))):
+        name, _, params = entry.partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur':
+                stages[name.strip()] = float(value)
+    return stages
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(pct / 100.0 * len(values)) - 1)]
+
+def peak_rss_mb():
+    """
+    Peak RSS of this process so far; one scenario per process makes it that scenario's peak.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+def build_request(template_bytes, data, doc_type, encoding):
+    if encoding == 'base64':
+        return {'json': {'template': base64.b64encode(template_bytes).decode(), 'data': data, 'doc_type': doc_type}}
+    return {
+        'data': {'template': (BytesIO(template_bytes), 'template.docx'), 'data': json.dumps(data), 'doc_type': doc_type},
+        'content_type': 'multipart/form-data',
+    }
+
+def run_scenario(client, memory, template_bytes, data, doc_type, encoding, iterations, max_seconds, concurrency):
+    counter = itertools.count()
+
+    def one():
+        # A distinct request number makes every request a different document. Identical
+        # concurrent requests would otherwise share one render through single-flight.
+        kwargs = build_request(template_bytes, dict(data, request=next(counter)), doc_type, encoding)
+        start = time.perf_counter()
+        response = client.post('/generate-docx', **kwargs)
+        body = response.get_data()
+        response.close()
+        if response.status_code != 200:
+            raise RuntimeError(f'{response.status_code}: {body[:200]!r}')
+        return time.perf_counter() - start, parse_server_timing(response.headers.get('Server-Timing'))
+
+    one()  # warm-up: fills the template cache and imports lazily loaded modules
+    memory.reset()
+    latencies = []
+    stages = defaultdict(list)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        while len(latencies) < iterations:
+            batch = min(concurrency, iterations - len(latencies))
+            for latency, timings in pool.map(lambda _: one(), range(batch)):
+                latencies.append(latency)
+                for stage, ms in timings.items():
+                    stages[stage].append(ms)
+            if time.perf_counter() - started > max_seconds and len(latencies) >= 3:
+                break
+    wall = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'throughput_rps': len(latencies) / wall,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'stages_ms': {stage: sum(t) / len(t) for stage, t in stages.items()},
+        'stage_peak_rss_mb': {stage: peak / (1024 * 1024) for stage, peak in memory.peaks.items()},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def scenario_main(spec, memory_enabled, real_soffice):
+    """
+    Run one scenario in this (fresh) process and print its result as JSON.
+    """
+    os.environ.setdefault('DOC_OUTPUT_CACHE_MEMORY_BYTES', '0')
+    os.environ.setdefault('DOC_OUTPUT_CACHE_DISK_BYTES', '0')
+    os.environ.setdefault('DOC_TEMPLATE_STORE', tempfile.mkdtemp(prefix='docgen-bench-'))
+    if not real_soffice:
+        os.environ['DOC_SOFFICE'] = STUB
+        os.environ['DOC_OFFICE_POOL_SIZE'] = '0'
+    sys.path.insert(0, ROOT)
+    import app
+
+    memory = StageMemory(memory_enabled)
+    memory.wrap(app.base64, 'b64decode', 'decode')
+    memory.wrap(app.validator.load(), 'validate_template', 'validate')
+    memory.wrap(app, 'compile_template', 'compile')
+    memory.wrap(app.render.CachedDocxTemplate, 'render', 'render')
+    memory.wrap(app.render.CachedDocxTemplate, 'render_streamed', 'render')
+    memory.wrap(app.render.CachedDocxTemplate, 'save', 'save')
+    memory.wrap(app, 'convert_to', 'convert')
+
+    template_bytes = make_template(spec['template'])
+    result = run_scenario(app.app.test_client(), memory, template_bytes, make_data(spec['rows']),
+                          spec['doc_type'], spec['input'], spec['iterations'], spec['max_seconds'],
+                          spec['concurrency'])
+    result.update(template=spec['template'], template_bytes=len(template_bytes), rows=spec['rows'],
+                  doc_type=spec['doc_type'], input=spec['input'], concurrency=spec['concurrency'])
+    print(json.dumps(result))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--templates', default='small,large')
+    parser.add_argument('--rows', default='10,1000,100000')
+    parser.add_argument('--doc-types', default='docx,pdf')
+    parser.add_argument('--inputs', default='multipart,base64')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--max-seconds', type=float, default=30, help='stop a scenario early after this long (min 3 requests)')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--memory', action='store_true', help='sample peak RSS per stage (from /proc/self/statm)')
+    parser.add_argument('--real-soffice', action='store_true', help='convert with the installed LibreOffice')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        scenario_main(json.loads(args.scenario), args.memory, args.real_soffice)
+        return
+
+    results = []
+    for size in args.templates.split(','):
+        for rows in [int(r) for r in args.rows.split(',')]:
+            for doc_type in args.doc_types.split(','):
+                for encoding in args.inputs.split(','):
+                    spec = {'template': size, 'rows': rows, 'doc_type': doc_type, 'input': encoding,
+                            'iterations': args.iterations, 'max_seconds': args.max_seconds,
+                            'concurrency': args.concurrency}
+                    command = [sys.executable, os.path.abspath(__file__), '--scenario', json.dumps(spec)]
+                    if args.memory:
+                        command.append('--memory')
+                    if args.real_soffice:
+                        command.append('--real-soffice')
+                    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+                    result = json.loads(output.strip().splitlines()[-1])
+                    results.append(result)
+                    stages = ' '.join(f'{k}={v:.1f}' for k, v in sorted(result['stages_ms'].items()))
+                    print(f"{size:5} rows={rows:<7} {doc_type:4} {encoding:9} "
+                          f"{result['throughput_rps']:8.2f} req/s  p50={result['p50_ms']:8.1f}ms "
+                          f"p95={result['p95_ms']:8.1f}ms p99={result['p99_ms']:8.1f}ms "
+                          f"rss={result['peak_rss_mb']:.0f}MB  [{stages}]", flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
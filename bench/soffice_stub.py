@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Stand-in for `soffice --headless --convert-to pdf --outdir DIR FILE...` so the benchmark runs
+without LibreOffice. Writes a one-page PDF per input and prints the same "convert ... -> ...
+using filter" lines LibreOffice does. DOC_STUB_SOFFICE_DELAY adds a per-file delay in seconds.
+"""
+import os
+import sys
+import time
+
+PDF = (b'%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n'
+       b'2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n'
+       b'3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]>>endobj\n'
+       b'trailer<</Root 1 0 R>>\n%%EOF\n')
+
+def main(args):
+    if '--outdir' not in args:
+        return 1
+    outdir = args[args.index('--outdir') + 1]
+    sources = [arg for arg in args[args.index('--outdir') + 2:] if not arg.startswith('-')]
+    delay = float(os.environ.get('DOC_STUB_SOFFICE_DELAY', '0'))
+    for source in sources:
+        time.sleep(delay)
+        target = os.path.join(outdir, os.path.splitext(os.path.basename(source))[0] + '.pdf')
+        with open(target, 'wb') as f:
+            f.write(PDF)
+        print(f'convert {source} -> {target} using filter : writer_pdf_Export')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
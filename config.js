@@ -1,10 +1,10 @@
 module.exports = {
     name: 'doc-app',
-    script: 'app.py',
+    script: 'serve.py',
     interpreter: 'python3',
     exec_mode: 'fork',
     instances: 1,
-    watch: true,
+    watch: false,
     max_memory_restart: "1G",
   };   
                              
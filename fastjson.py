@@ -0,0 +1,27 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def loads(data):
+    """
+    Parse JSON from str or bytes, with orjson when it is installed. Invalid JSON raises
+    json.JSONDecodeError (a ValueError) either way.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def canonical_dumps(data):
+    """
+    Compact, key-sorted UTF-8 JSON bytes.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+        except TypeError:
+            # e.g. integers beyond 64 bits, which only the standard library handles
+            pass
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode()
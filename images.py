@@ -0,0 +1,145 @@
+import os
+import base64
+import binascii
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from io import BytesIO
+
+from docx.image.exceptions import UnrecognizedImageError
+from docx.image.image import Image
+from docx.shared import Emu, Mm
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+IMAGE_CACHE_BYTES = int(os.environ.get('DOC_IMAGE_CACHE_BYTES', str(64 * 1024 * 1024)))
+IMAGE_DPI = int(os.environ.get('DOC_IMAGE_DPI', '200'))
+EMU_PER_INCH = 914400
+
+# A value in data is an image when it is a dict with one of these keys (plus optional width_mm/height_mm).
+INLINE_KEY = '$image'
+STORED_KEY = '$image_id'
+
+PreparedImage = namedtuple('PreparedImage', 'blob width height')
+
+def is_image_ref(value):
+    return value.__class__ is dict and (INLINE_KEY in value or STORED_KEY in value)
+
+def _size_mm(ref, name):
+    value = ref.get(name)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        raise ValueError(f"Image {name} must be a positive number.")
+    return value
+
+def parse_image(blob):
+    try:
+        return Image.from_blob(blob)
+    except UnrecognizedImageError:
+        raise ValueError("Image data is not a supported image format.")
+
+def prepare_image(blob, width_mm=None, height_mm=None, dpi=IMAGE_DPI):
+    """
+    Work out the display size of an image (keeping its aspect ratio when only one side is given)
+    and, with Pillow installed, downscale images with more pixels than that size needs at dpi.
+    """
+    image = parse_image(blob)
+    width, height = image.scaled_dimensions(Mm(width_mm) if width_mm else None, Mm(height_mm) if height_mm else None)
+    target = (max(1, round(width / EMU_PER_INCH * dpi)), max(1, round(height / EMU_PER_INCH * dpi)))
+    if PILImage is not None and image.px_width > target[0] * 1.1 and image.content_type in ('image/png', 'image/jpeg'):
+        with PILImage.open(BytesIO(blob)) as pil_image:
+            pil_image.load()
+            resized = pil_image.resize(target, PILImage.LANCZOS)
+        output = BytesIO()
+        if image.content_type == 'image/jpeg':
+            resized.save(output, 'JPEG', quality=90, dpi=(dpi, dpi))
+        else:
+            resized.save(output, 'PNG', optimize=False, dpi=(dpi, dpi))
+        blob = output.getvalue()
+    return PreparedImage(blob, Emu(width), Emu(height))
+
+class ImageCache:
+    """
+    LRU cache of prepared images keyed by (source SHA-256, width_mm, height_mm), bounded by
+    the total size of the prepared image bytes.
+    """
+    def __init__(self, store, max_bytes=IMAGE_CACHE_BYTES):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, ref):
+        """
+        Return the PreparedImage for an image reference from data: {"$image": base64 or data URI}
+        or {"$image_id": registered image ID}, with optional width_mm and height_mm. Inline images
+        are keyed by the hash of their base64 text, so cache hits skip decoding.
+        """
+        width_mm, height_mm = _size_mm(ref, 'width_mm'), _size_mm(ref, 'height_mm')
+        if STORED_KEY in ref:
+            stored = self.store.get(str(ref[STORED_KEY]))
+            source_key = stored.sha256
+            load = lambda: self.store.read(stored)
+        else:
+            text = ref[INLINE_KEY]
+            if not isinstance(text, str):
+                raise ValueError("Inline image must be a base64 string.")
+            if text.startswith('data:'):
+                text = text.partition(',')[2]
+            source_key = hashlib.sha256(text.encode()).hexdigest()
+            load = lambda: _b64decode(text)
+        key = (source_key, width_mm, height_mm)
+
+        with self._lock:
+            prepared = self._entries.get(key)
+            if prepared is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return prepared
+            self.misses += 1
+
+        prepared = prepare_image(load(), width_mm, height_mm)
+        if len(prepared.blob) > self.max_bytes:
+            return prepared
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = prepared
+                self._size += len(prepared.blob)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.blob)
+        return prepared
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'bytes': self._size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+def _b64decode(text):
+    try:
+        return base64.b64decode(text)
+    except binascii.Error:
+        raise ValueError("Inline image is not valid base64.")
+
+def stored_image_ids(data):
+    """
+    Registered image IDs referenced anywhere in data.
+    """
+    ids = []
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            if STORED_KEY in value:
+                ids.append(str(value[STORED_KEY]))
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return ids
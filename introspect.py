@@ -0,0 +1,242 @@
+from collections.abc import Iterator
+
+from jinja2 import meta, nodes
+
+from images import is_image_ref
+
+# Path step for "an element of this list", from loops and constant integer subscripts.
+ELEMENT = '[]'
+
+# loop attributes holding a neighbouring item of the innermost loop, and the scope entry for
+# that loop's item path (not a valid name, so it cannot clash with a template variable).
+LOOP_ITEMS = {'previtem', 'nextitem'}
+LOOP_ITEM = 'loop.item'
+
+# Tests and filters that only look at whether a value is there, its truthiness or its length.
+SHAPE_TESTS = {'defined', 'undefined', 'none'}
+SHAPE_FILTERS = {'length', 'count'}
+
+def _mark(fields, path, whole):
+    """
+    Record that path is read: as a whole (None in the tree) or only for fields read from it.
+    """
+    keys = [key for key in path if key != ELEMENT]
+    for i, key in enumerate(keys):
+        if key in fields and fields[key] is None:
+            return
+        if i == len(keys) - 1:
+            if whole:
+                fields[key] = None
+            else:
+                fields.setdefault(key, {})
+        else:
+            fields = fields.setdefault(key, {})
+
+def _names(target):
+    if isinstance(target, nodes.Name):
+        return [target.name]
+    return [name.name for name in target.find_all(nodes.Name)]
+
+def _format_path(path):
+    return ''.join(key if key == ELEMENT or i == 0 else '.' + key for i, key in enumerate(path))
+
+def _prune(value, fields):
+    if fields is None or is_image_ref(value):
+        return value
+    if isinstance(value, dict):
+        pruned = {key: _prune(value[key], sub) for key, sub in fields.items() if key in value}
+        # A mapping the template only tests must stay truthy.
+        return pruned if pruned or not value else value
+    if isinstance(value, list):
+        return [_prune(item, fields) for item in value]
+    if isinstance(value, Iterator):
+        return (_prune(item, fields) for item in value)
+    return value
+
+class TemplateSchema:
+    """
+    What a template reads from its data, collected from the Jinja AST of each of its parts:
+    the top-level variables, the tree of fields read below them and the loops. In the field
+    tree None marks a value used as a whole (output, passed to a filter, compared) and a dict
+    the fields read from it, empty if it is only tested or counted; lists are transparent, the
+    fields of a list are those read from its items. Templates that include or import others
+    cannot be analysed and are marked incomplete.
+    """
+    def __init__(self, ignore=()):
+        self.fields = {}
+        self.loops = []
+        self.complete = True
+        self._ignore = set(ignore)
+
+    def add(self, part, ast):
+        roots = meta.find_undeclared_variables(ast) - self._ignore
+        walker = _Walker(self, part, roots)
+        walker.body(ast.body, {}, self.loops)
+        # Names the walk lost track of, e.g. set in one branch and read from the data in another.
+        for name in roots:
+            if name in walker.assigned or name not in walker.seen:
+                _mark(self.fields, (name,), True)
+
+    @property
+    def variables(self):
+        return sorted(self.fields)
+
+    def to_dict(self):
+        return {'variables': self.variables, 'fields': self.fields, 'loops': self.loops,
+                'complete': self.complete}
+
+    def prune(self, data):
+        """
+        data reduced to the fields the template reads; unchanged if the schema is incomplete.
+        Lists are rebuilt and streamed rows pruned as they are read, the items are not copied.
+        """
+        if not self.complete or not isinstance(data, dict):
+            return data
+        return {key: _prune(data[key], sub) for key, sub in self.fields.items() if key in data}
+
+class _Walker:
+    """
+    One pass over the AST of a template part. scope maps names bound by the template to the
+    data path they stand for (loop variables) or to None (anything else).
+    """
+    def __init__(self, schema, part, roots):
+        self.schema = schema
+        self.part = part
+        self.roots = roots
+        self.seen = set()
+        self.assigned = set()
+
+    def path(self, node, scope):
+        """
+        The data path a plain lookup (name, attribute, constant subscript) reads, else None.
+        """
+        if isinstance(node, nodes.Name):
+            if node.name in scope:
+                return scope[node.name]
+            if node.name in self.roots:
+                self.seen.add(node.name)
+                return (node.name,)
+            return None
+        if (isinstance(node, nodes.Getattr) and node.attr in LOOP_ITEMS and isinstance(node.node, nodes.Name)
+                and node.node.name == 'loop' and 'loop' not in scope):
+            return scope.get(LOOP_ITEM)
+        if isinstance(node, nodes.Getattr):
+            key = node.attr
+        elif isinstance(node, nodes.Getitem) and isinstance(node.arg, nodes.Const):
+            key = node.arg.value
+            if isinstance(key, int) and not isinstance(key, bool):
+                key = ELEMENT
+        else:
+            return None
+        if not isinstance(key, str):
+            return None
+        parent = self.path(node.node, scope)
+        return parent + (key,) if parent else None
+
+    def expr(self, node, scope, whole=True):
+        if node is None:
+            return
+        path = self.path(node, scope)
+        if path is not None:
+            _mark(self.schema.fields, path, whole)
+        elif isinstance(node, nodes.Not):
+            self.expr(node.node, scope, False)
+        elif isinstance(node, (nodes.And, nodes.Or)) and not whole:
+            self.expr(node.left, scope, False)
+            self.expr(node.right, scope, False)
+        elif isinstance(node, nodes.CondExpr):
+            self.expr(node.test, scope, False)
+            self.expr(node.expr1, scope)
+            self.expr(node.expr2, scope)
+        elif isinstance(node, nodes.Test) and node.name in SHAPE_TESTS:
+            self.expr(node.node, scope, False)
+        elif isinstance(node, nodes.Filter) and node.name in SHAPE_FILTERS and node.node is not None:
+            self.expr(node.node, scope, False)
+        elif isinstance(node, nodes.Call) and isinstance(node.node, nodes.Getattr):
+            # A method call (customer.get('x'), row.items()) needs the whole object.
+            self.expr(node.node.node, scope)
+            for child in node.iter_child_nodes(exclude=('node',)):
+                self.expr(child, scope)
+        else:
+            for child in node.iter_child_nodes():
+                self.expr(child, scope)
+
+    def bind(self, target, scope, path=None):
+        if isinstance(target, nodes.Name):
+            scope[target.name] = path
+        elif isinstance(target, nodes.Tuple):
+            for item in target.items:
+                self.bind(item, scope)
+
+    def body(self, statements, scope, loops):
+        for node in statements:
+            self.stmt(node, scope, loops)
+
+    def stmt(self, node, scope, loops):
+        if isinstance(node, nodes.For):
+            self.for_loop(node, scope, loops)
+        elif isinstance(node, nodes.If):
+            self.expr(node.test, scope, False)
+            self.body(node.body, scope, loops)
+            self.body(node.elif_, scope, loops)
+            self.body(node.else_, scope, loops)
+        elif isinstance(node, nodes.Assign):
+            self.expr(node.node, scope)
+            self.assign(node.target, scope)
+        elif isinstance(node, nodes.AssignBlock):
+            self.expr(node.filter, scope)
+            self.body(node.body, scope, loops)
+            self.assign(node.target, scope)
+        elif isinstance(node, (nodes.Macro, nodes.CallBlock)):
+            if isinstance(node, nodes.Macro):
+                scope[node.name] = None
+                self.assigned.add(node.name)
+            else:
+                self.expr(node.call, scope)
+            for default in node.defaults:
+                self.expr(default, scope)
+            inner = dict(scope)
+            for arg in node.args:
+                self.bind(arg, inner)
+            self.body(node.body, inner, loops)
+        elif isinstance(node, nodes.With):
+            for value in node.values:
+                self.expr(value, scope)
+            inner = dict(scope)
+            for target in node.targets:
+                self.bind(target, inner)
+            self.body(node.body, inner, loops)
+        elif isinstance(node, (nodes.Include, nodes.Import, nodes.FromImport, nodes.Extends)):
+            self.schema.complete = False
+        else:
+            for child in node.iter_child_nodes():
+                if isinstance(child, nodes.Stmt):
+                    self.stmt(child, scope, loops)
+                else:
+                    self.expr(child, scope)
+
+    def assign(self, target, scope):
+        self.assigned.update(_names(target))
+        self.bind(target, scope)
+
+    def for_loop(self, node, scope, loops):
+        path = self.path(node.iter, scope)
+        if path is None:
+            self.expr(node.iter, scope)
+        else:
+            _mark(self.schema.fields, path, False)
+        inner = dict(scope)
+        single = isinstance(node.target, nodes.Name)
+        self.bind(node.target, inner, path + (ELEMENT,) if path and single else None)
+        # loop.previtem and loop.nextitem are items of the same list.
+        inner[LOOP_ITEM] = path + (ELEMENT,) if path else None
+        self.expr(node.test, inner, False)
+        nested = []
+        self.body(node.body, inner, nested)
+        self.body(node.else_, scope, loops)
+        loops.append({
+            'path': _format_path(path) if path else None,
+            'target': ', '.join(_names(node.target)),
+            'part': self.part,
+            'loops': nested,
+        })
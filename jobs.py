@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import uuid
+import queue
+import shutil
+import socket
+import tempfile
+import threading
+
+from admission import AdmissionRejected
+from office import ConversionBusy
+from scratch import pid_alive
+
+JOB_WORKERS = int(os.environ.get('DOC_JOB_WORKERS', '2'))
+JOB_QUEUE_SIZE = int(os.environ.get('DOC_JOB_QUEUE_SIZE', '100'))
+JOB_RESULT_TTL = float(os.environ.get('DOC_JOB_RESULT_TTL', '3600'))
+JOB_DIR = os.environ.get('DOC_JOB_DIR', os.path.join(tempfile.gettempdir(), 'docgen-jobs'))
+# Longer than a job can legitimately run: admission wait, slot wait and a conversion with retries.
+JOB_TIMEOUT = float(os.environ.get('DOC_JOB_TIMEOUT', '900'))
+
+HOST = socket.gethostname()
+
+class QueueFull(Exception):
+    pass
+
+class JobQueue:
+    """
+    Bounded queue of document jobs run by a fixed set of background threads. Job state and
+    results live in result_dir as <id>.json and <id>.out, so any worker process sharing the
+    directory can answer status polls; both are removed ttl seconds after the job finishes.
+    Jobs record the process that owns them: one whose process has exited (a recycled or
+    restarted worker) or that has been running for more than timeout seconds is marked failed.
+    """
+    def __init__(self, workers=JOB_WORKERS, maxsize=JOB_QUEUE_SIZE, ttl=JOB_RESULT_TTL, result_dir=JOB_DIR,
+                 timeout=JOB_TIMEOUT):
+        self.workers = workers
+        self.ttl = ttl
+        self.timeout = timeout
+        self.result_dir = result_dir
+        self._queue = queue.Queue(maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._last_sweep = 0
+        os.makedirs(result_dir, exist_ok=True)
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f'doc-job-{len(self._threads)}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _path(self, job_id, ext):
+        return os.path.join(self.result_dir, f'{job_id}.{ext}')
+
+    def _save(self, job):
+        fd, tmp_path = tempfile.mkstemp(dir=self.result_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._path(job['id'], 'json'))
+
+    def submit(self, fn, *args):
+        """
+        Queue fn(*args, workdir), which must return (path or file object, mimetype, filename) and may
+        use workdir as scratch space. Raises QueueFull when the queue is at capacity.
+        """
+        self._start()
+        self.sweep()
+        job = {'id': uuid.uuid4().hex, 'status': 'queued', 'created': time.time(), 'host': HOST, 'pid': os.getpid()}
+        self._save(job)
+        try:
+            self._queue.put_nowait((job, fn, args))
+        except queue.Full:
+            os.unlink(self._path(job['id'], 'json'))
+            raise QueueFull("Job queue is full, retry later.")
+        return job
+
+    def get(self, job_id):
+        if not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        self.sweep()
+        try:
+            with open(self._path(job_id, 'json')) as f:
+                job = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        self._check_abandoned(job)
+        return job
+
+    def _check_abandoned(self, job):
+        """
+        Mark an unfinished job failed if its owner process is gone or it ran past the timeout.
+        Returns whether the job is finished.
+        """
+        if job.get('status') in ('done', 'failed'):
+            return True
+        if job.get('host') == HOST and not pid_alive(job.get('pid', 0)):
+            error = "Job was lost when its worker process exited, submit it again."
+        elif job.get('status') == 'running' and time.time() - job['started'] > self.timeout:
+            error = f"Job did not finish within {self.timeout:.0f} seconds."
+        else:
+            return False
+        job.update(status='failed', error=error, code=500, finished=time.time())
+        self._save(job)
+        return True
+
+    def result_path(self, job):
+        return self._path(job['id'], 'out')
+
+    def _work(self):
+        while True:
+            job, fn, args = self._queue.get()
+            job['status'] = 'running'
+            job['started'] = time.time()
+            self._save(job)
+            # Named after this process, so sweep() knows when its owner is gone.
+            workdir = tempfile.mkdtemp(dir=self.result_dir, prefix=f'{os.getpid()}-', suffix='.work')
+            try:
+                result, mimetype, filename = fn(*args, workdir)
+                if hasattr(result, 'read'):
+                    with open(self._path(job['id'], 'out'), 'wb') as f:
+                        shutil.copyfileobj(result, f)
+                elif os.path.dirname(result) == workdir:
+                    os.replace(result, self._path(job['id'], 'out'))
+                else:
+                    shutil.copyfile(result, self._path(job['id'], 'out'))
+                job.update(status='done', mimetype=mimetype, filename=filename)
+            except (AdmissionRejected, ConversionBusy) as e:
+                # Answered like the synchronous request would have been, so clients can back off.
+                job.update(status='failed', error=str(e), code=e.status)
+                if e.retry_after:
+                    job['retry_after'] = e.retry_after
+            except ValueError as e:
+                job.update(status='failed', error=str(e), code=400)
+            except Exception as e:
+                job.update(status='failed', error=str(e), code=500)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+                job['finished'] = time.time()
+                self._save(job)
+                self._queue.task_done()
+
+    def sweep(self):
+        """
+        Delete state and results of jobs that finished more than ttl seconds ago, after marking
+        abandoned ones failed, and working directories whose process is gone or older than ttl.
+        """
+        now = time.time()
+        if now - self._last_sweep < min(self.ttl, 60):
+            return
+        self._last_sweep = now
+        for entry in os.listdir(self.result_dir):
+            path = os.path.join(self.result_dir, entry)
+            try:
+                if entry.endswith('.json'):
+                    with open(path) as f:
+                        if not self._check_abandoned(json.load(f)):
+                            continue
+                owner = entry.split('-', 1)[0] if entry.endswith('.work') else ''
+                orphaned = owner.isdigit() and not pid_alive(int(owner))
+                if not orphaned and now - os.path.getmtime(path) <= self.ttl:
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.unlink(path)
+            except (OSError, ValueError):
+                continue
@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import atexit
+import tempfile
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from scratch import pid_alive
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(11))
+
+METRICS_DIR = os.environ.get('DOC_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'docgen-metrics'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('DOC_METRICS_FLUSH_INTERVAL', '5'))
+RETIRED = 'retired.json'
+
+_registry = []
+_collectors = []
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+_collect_lock = threading.Lock()
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, values)) + '}'
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {} if self.labels else {(): 0}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(values, other):
+        for key, value in other.items():
+            values[key] = values.get(key, 0) + value
+
+    def expose(self, values=None):
+        if values is None:
+            values = self.snapshot()
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_labels(self.labels, key)} {value}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict((key, [list(counts), total, count]) for key, (counts, total, count) in self._values.items())
+
+    @staticmethod
+    def merge(values, other):
+        for key, (counts, total, count) in other.items():
+            entry = values.get(key)
+            if entry is None:
+                values[key] = [list(counts), total, count]
+                continue
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+            entry[2] += count
+
+    def expose(self, values=None):
+        if values is None:
+            values = self.snapshot()
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_labels(self.labels + ("le",), key + (bound,))} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, key)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labels, key)} {count}')
+        return lines
+
+def register_collector(fn):
+    """
+    Register fn() returning [(name, type, documentation, value)] sampled at scrape time, e.g. cache counters.
+    """
+    _collectors.append(fn)
+
+def _write(path, metric_values, collected):
+    snapshot = {'metrics': dict((name, [[list(key), value] for key, value in values.items()])
+                                for name, values in metric_values.items()),
+                'collected': [list(sample) for sample in collected]}
+    fd, tmp_path = tempfile.mkstemp(dir=METRICS_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+def flush():
+    """
+    Write this process's metrics to METRICS_DIR/<pid>.json, where the scrapes of every worker read them.
+    """
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write(os.path.join(METRICS_DIR, f'{os.getpid()}.json'),
+           dict((metric.name, metric.snapshot()) for metric in _registry),
+           [sample for fn in _collectors for sample in fn()])
+
+def _flush_quietly():
+    try:
+        flush()
+    except OSError:
+        pass
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        _flush_quietly()
+
+def start_flusher():
+    """
+    Start flushing this process's metrics every METRICS_FLUSH_INTERVAL seconds and on exit, once
+    per process: workers forked from a preloaded app each start their own.
+    """
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            _flusher_pid = os.getpid()
+            atexit.register(_flush_quietly)
+            threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+@contextmanager
+def _locked():
+    # Folding a dead worker into retired.json must happen once, even if two workers scrape at once.
+    with _collect_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(METRICS_DIR, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _merge(totals, collected, snapshot, gauges=True):
+    for name, samples in snapshot.get('metrics', {}).items():
+        metric = totals.get(name)
+        if metric is not None:
+            metric[0].merge(metric[1], dict((tuple(key), value) for key, value in samples))
+    for name, kind, documentation, value in snapshot.get('collected', []):
+        if kind != 'gauge' or gauges:
+            entry = collected.setdefault(name, [kind, documentation, 0])
+            entry[2] += value
+
+def collect():
+    """
+    Sum the metrics of every worker process on the host from their snapshots in METRICS_DIR.
+    Snapshots of dead workers are folded into retired.json, keeping their counters and histograms
+    so totals never go backwards when gunicorn recycles a worker; their gauges are dropped.
+    Returns ({metric name: {label values: value}}, {collector name: [type, documentation, value]}).
+    """
+    flush()
+    totals = dict((metric.name, (metric, {})) for metric in _registry)
+    collected = {}
+    with _locked():
+        retired_path = os.path.join(METRICS_DIR, RETIRED)
+        retired_totals = dict((metric.name, (metric, {})) for metric in _registry)
+        retired_collected = {}
+        _merge(retired_totals, retired_collected, _read(retired_path) or {})
+        changed = False
+        for entry in os.listdir(METRICS_DIR):
+            pid = entry[:-len('.json')]
+            if not entry.endswith('.json') or not pid.isdigit():
+                continue
+            path = os.path.join(METRICS_DIR, entry)
+            snapshot = _read(path)
+            if snapshot is None:
+                continue
+            if int(pid) == os.getpid() or pid_alive(int(pid)):
+                _merge(totals, collected, snapshot)
+            else:
+                _merge(retired_totals, retired_collected, snapshot, gauges=False)
+                os.remove(path)
+                changed = True
+        if changed:
+            _write(retired_path, dict((name, values) for name, (metric, values) in retired_totals.items()),
+                   [[name, *entry] for name, entry in retired_collected.items()])
+    for name, (metric, values) in retired_totals.items():
+        metric.merge(totals[name][1], values)
+    for name, (kind, documentation, value) in retired_collected.items():
+        collected.setdefault(name, [kind, documentation, 0])[2] += value
+    return dict((name, values) for name, (metric, values) in totals.items()), collected
+
+def expose():
+    """
+    Render the metrics of all worker processes on the host, summed, in the Prometheus text exposition format.
+    """
+    values, collected = collect()
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.expose(values[metric.name]))
+    for name, (kind, documentation, value) in collected.items():
+        lines.extend([f'# HELP {name} {documentation}', f'# TYPE {name} {kind}', f'{name} {value}'])
+    return '\n'.join(lines) + '\n'
+
+STAGE_SECONDS = Histogram('docgen_stage_seconds', 'Time spent in each document pipeline stage.', ['stage'])
+TEMPLATE_BYTES = Histogram('docgen_template_bytes', 'Size of templates used for rendering.', buckets=BYTES_BUCKETS)
+DATA_BYTES = Histogram('docgen_data_bytes', 'Size of the canonical JSON data per request.', buckets=BYTES_BUCKETS)
+OUTPUT_BYTES = Histogram('docgen_output_bytes', 'Size of generated documents.', ['doc_type'], buckets=BYTES_BUCKETS)
+CONVERSION_FAILURES = Counter('docgen_conversion_failures_total', 'PDF conversions that failed.')
+CONVERSION_ATTEMPTS = Counter('docgen_conversion_attempts_total',
+                              'LibreOffice conversion attempts by outcome (ok, rejected, timeout, crash, error).', ['outcome'])
+CONVERSION_RETRIES = Counter('docgen_conversion_retries_total', 'Conversions retried on a fresh LibreOffice instance.')
+CONVERSION_KILLS = Counter('docgen_conversion_kills_total', 'LibreOffice process groups killed after their deadline.')
+CONVERSION_CIRCUIT_OPENED = Counter('docgen_conversion_circuit_opened_total', 'Times the conversion circuit breaker opened.')
+CONVERSION_CIRCUIT_REJECTED = Counter('docgen_conversion_circuit_rejected_total',
+                                      'Conversions refused while the circuit breaker was open.')
+CONVERSION_BATCH_SIZE = Histogram('docgen_conversion_batch_size', 'Documents converted per LibreOffice run.',
+                                  buckets=(1, 2, 4, 8, 16, 32, 64))
+BATCH_RECORD_FAILURES = Counter('docgen_batch_record_failures_total',
+                                'Batch records left out of the ZIP by the stage that failed (render, convert).', ['stage'])
+REQUESTS = Counter('docgen_requests_total', 'HTTP requests by endpoint and status.', ['endpoint', 'status'])
+
+_timings = contextvars.ContextVar('docgen_timings', default=None)
+
+def start_timings():
+    """
+    Start collecting stage timings for the current request; returns the list they are appended to.
+    """
+    start_flusher()
+    timings = []
+    _timings.set(timings)
+    return timings
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+def server_timing(timings):
+    """
+    Format collected timings as a Server-Timing header value, summing repeated stages.
+    """
+    totals = {}
+    for name, elapsed in timings:
+        totals[name] = totals.get(name, 0.0) + elapsed
+    return ', '.join(f'{name};dur={elapsed * 1000:.1f}' for name, elapsed in totals.items())
@@ -0,0 +1,740 @@
+import os
+import re
+import sys
+import math
+import signal
+import queue
+import atexit
+import shutil
+import tempfile
+import threading
+import subprocess
+import time
+from contextlib import contextmanager, ExitStack
+from pathlib import Path
+
+import metrics
+from scratch import get_scratch
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+except ImportError:
+    uno = None
+
+POOL_SIZE = int(os.environ.get('DOC_OFFICE_POOL_SIZE', '2'))
+MAX_CONVERSIONS = int(os.environ.get('DOC_OFFICE_MAX_CONVERSIONS', '200'))
+START_TIMEOUT = float(os.environ.get('DOC_OFFICE_START_TIMEOUT', '30'))
+ACQUIRE_TIMEOUT = float(os.environ.get('DOC_OFFICE_ACQUIRE_TIMEOUT', '60'))
+CONVERT_TIMEOUT = float(os.environ.get('DOC_CONVERT_TIMEOUT', '300'))
+MAX_CONCURRENT = int(os.environ.get('DOC_MAX_CONCURRENT_CONVERSIONS', str(os.cpu_count() or 2)))
+SLOT_WAIT = float(os.environ.get('DOC_CONVERSION_SLOT_WAIT', '10'))
+MAX_WAITING = int(os.environ.get('DOC_CONVERSION_MAX_WAITING', str(2 * MAX_CONCURRENT)))
+SLOT_DIR = os.environ.get('DOC_CONVERSION_SLOT_DIR', os.path.join(tempfile.gettempdir(), 'docgen-convert-slots'))
+CONVERT_RETRIES = int(os.environ.get('DOC_CONVERT_RETRIES', '1'))
+BREAKER_FAILURES = int(os.environ.get('DOC_CONVERT_BREAKER_FAILURES', '5'))
+BREAKER_RESET = float(os.environ.get('DOC_CONVERT_BREAKER_RESET', '30'))
+BATCH_WINDOW = float(os.environ.get('DOC_CONVERT_BATCH_WINDOW', '0.05'))
+BATCH_SIZE = int(os.environ.get('DOC_CONVERT_BATCH_SIZE', '8'))
+
+class ConversionBusy(Exception):
+    """
+    Raised when no conversion slot is available; status is the HTTP status to answer with.
+    """
+    def __init__(self, message, status=503, retry_after=5):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+class ConversionFailed(Exception):
+    """
+    Raised when LibreOffice did not produce a PDF; the message says why.
+    """
+
+class ConversionTimeout(ConversionFailed):
+    pass
+
+class ConversionCrashed(ConversionFailed):
+    pass
+
+class CircuitBreaker:
+    """
+    Fails conversions fast while LibreOffice looks unhealthy. After `failures` conversions in a
+    row have failed (retries included), the breaker opens and conversions are refused with
+    ConversionBusy for reset_after seconds. Then one trial conversion is let through: its
+    success closes the breaker, its failure opens it again.
+    """
+    def __init__(self, failures=BREAKER_FAILURES, reset_after=BREAKER_RESET):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self._opened_at = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed' or self.failures <= 0:
+                return
+            remaining = self._opened_at + self.reset_after - time.monotonic()
+            if self.state == 'open' and remaining <= 0:
+                self.state = 'half-open'
+            if self.state == 'half-open' and not self._trial:
+                self._trial = True
+                return
+        metrics.CONVERSION_CIRCUIT_REJECTED.inc()
+        raise ConversionBusy("PDF conversion is failing, retry later.", status=503,
+                             retry_after=max(1, math.ceil(remaining)))
+
+    def success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial = False
+            if self.failures > 0 and (self.state == 'half-open' or self.consecutive_failures >= self.failures):
+                if self.state != 'open':
+                    metrics.CONVERSION_CIRCUIT_OPENED.inc()
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+breaker = CircuitBreaker()
+metrics.register_collector(lambda: [
+    ('docgen_conversion_circuit_open', 'gauge', 'Worker processes whose conversion circuit breaker refuses conversions.',
+     int(breaker.state != 'closed')),
+])
+
+def supervised(convert, *args, allow=True):
+    """
+    Run convert(*args, fresh=...) under the circuit breaker. Timeouts, crashes and unexpected
+    errors are retried up to CONVERT_RETRIES times with fresh=True (on a fresh LibreOffice
+    instance) and count against the breaker; a document LibreOffice cleanly refuses to convert
+    (plain ConversionFailed) is neither retried nor held against it. allow=False skips asking
+    the breaker, for callers that already were let through.
+    """
+    if allow:
+        breaker.allow()
+    for attempt in range(CONVERT_RETRIES + 1):
+        if attempt:
+            metrics.CONVERSION_RETRIES.inc()
+        try:
+            result = convert(*args, fresh=attempt > 0)
+        except ConversionTimeout as e:
+            error, outcome = e, 'timeout'
+        except ConversionCrashed as e:
+            error, outcome = e, 'crash'
+        except ConversionFailed:
+            metrics.CONVERSION_ATTEMPTS.inc(outcome='rejected')
+            breaker.success()
+            raise
+        except Exception as e:
+            error, outcome = e, 'error'
+        else:
+            metrics.CONVERSION_ATTEMPTS.inc(outcome='ok')
+            breaker.success()
+            return result
+        metrics.CONVERSION_ATTEMPTS.inc(outcome=outcome)
+    breaker.failure()
+    raise error
+
+def kill_process_group(process):
+    """
+    SIGKILL process and everything it started (it must have been started with
+    start_new_session=True), e.g. the soffice.bin behind the soffice launcher script.
+    """
+    if process.poll() is not None:
+        return
+    metrics.CONVERSION_KILLS.inc()
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+def run_soffice(args, timeout, progress=None):
+    """
+    Run a one-shot soffice in its own process group, killing the whole group if it is still
+    running after timeout seconds. With progress, a function returning how many documents are
+    done, the deadline restarts whenever that number grows, so each document of a multi-file
+    run gets timeout seconds of its own. Returns (returncode, stdout, stderr) as text.
+    """
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    deadline = time.monotonic() + timeout
+    done = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            stdout, stderr = process.communicate(timeout=max(0, min(remaining, 0.5) if progress else remaining))
+            break
+        except subprocess.TimeoutExpired:
+            if progress is not None and progress() > done:
+                done = progress()
+                deadline = time.monotonic() + timeout
+            elif time.monotonic() >= deadline:
+                kill_process_group(process)
+                process.communicate()
+                raise ConversionTimeout(f"PDF conversion did not finish within {timeout:g} seconds.")
+    return process.returncode, stdout.decode(errors='replace'), stderr.decode(errors='replace')
+
+def one_shot_args(folder, sources, profile_dir=None):
+    args = [libreoffice_exec(), '--headless']
+    if profile_dir:
+        args.append(f'-env:UserInstallation={Path(profile_dir).as_uri()}')
+    return args + ['--convert-to', 'pdf', '--outdir', folder, *sources]
+
+class ConversionSlots:
+    """
+    Limit on concurrent conversions shared by every worker process on the host. Each slot is a
+    lock file in slot_dir held with flock() while a conversion runs, so a crashed worker releases
+    its slot automatically. Callers wait up to `wait` seconds for a slot (503 after that); when
+    max_waiting callers of this process are already waiting, new ones are refused at once (429).
+    acquire() yields the slot's own LibreOffice profile directory: one-shot soffice runs sharing
+    a profile hand their work to whichever instance is already running it, or exit unconverted.
+    Without fcntl the limit only applies within the process.
+    """
+    def __init__(self, limit=MAX_CONCURRENT, slot_dir=SLOT_DIR, wait=SLOT_WAIT, max_waiting=MAX_WAITING):
+        self.limit = limit
+        self.slot_dir = slot_dir
+        self.wait = wait
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self._lock = threading.Lock()
+        self._free = set(range(limit))
+        os.makedirs(slot_dir, exist_ok=True)
+
+    def _try_take(self, indices=None):
+        """
+        Take a free slot out of indices (all by default); returns (index, lock fd or None), or
+        None if all are taken.
+        """
+        indices = range(self.limit) if indices is None else indices
+        if fcntl is None:
+            with self._lock:
+                free = self._free.intersection(indices)
+                if not free:
+                    return None
+                index = free.pop()
+                self._free.discard(index)
+                return index, None
+        for i in indices:
+            fd = os.open(os.path.join(self.slot_dir, f'slot-{i}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return i, fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def _release(self, slot):
+        index, fd = slot
+        if fd is None:
+            with self._lock:
+                self._free.add(index)
+        else:
+            os.close(fd)
+
+    def profile_dir(self, index):
+        return os.path.join(self.slot_dir, f'profile-{index}')
+
+    @contextmanager
+    def hold(self, index):
+        """
+        Take slot index without waiting; yields its profile directory, or None if it is taken.
+        """
+        slot = self._try_take([index])
+        try:
+            yield self.profile_dir(index) if slot else None
+        finally:
+            if slot:
+                self._release(slot)
+
+    @contextmanager
+    def acquire(self, wait=None):
+        wait = self.wait if wait is None else wait
+        slot = self._try_take()
+        if slot is None:
+            with self._lock:
+                if self.waiting >= self.max_waiting:
+                    raise ConversionBusy("Too many PDF conversions queued, retry later.", status=429)
+                self.waiting += 1
+            try:
+                deadline = time.monotonic() + wait
+                delay = 0.01
+                while slot is None:
+                    if time.monotonic() >= deadline:
+                        raise ConversionBusy("PDF conversion capacity exhausted, retry later.", status=503)
+                    time.sleep(delay)
+                    delay = min(delay * 2, 0.2)
+                    slot = self._try_take()
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+        try:
+            yield self.profile_dir(slot[0])
+        finally:
+            self._release(slot)
+
+class _PendingConversion:
+    def __init__(self, folder, source):
+        self.folder = folder
+        self.source = source
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+class ConversionBatcher:
+    """
+    Coalesces concurrent one-shot conversions of this process into a single soffice run. The
+    first caller of a batch collects others for up to `window` seconds or until `size` documents
+    are queued, then converts them all with one --convert-to call holding one conversion slot;
+    each caller gets its own PDF in its own folder, or the error of just its own file (see
+    _convert_batch). The window is only waited while another batch is converting, so an idle
+    server adds no latency.
+    """
+    def __init__(self, window=BATCH_WINDOW, size=BATCH_SIZE):
+        self.window = window
+        self.size = size
+        self.active = 0
+        self._forming = None
+        self._cond = threading.Condition()
+
+    def convert(self, folder, source, timeout=None):
+        item = _PendingConversion(folder, source)
+        with self._cond:
+            batch = self._forming
+            leader = batch is None or len(batch) >= self.size
+            if leader:
+                batch = self._forming = [item]
+                deadline = time.monotonic() + self.window
+                while self.active and len(batch) < self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._forming is batch:
+                    self._forming = None
+                self.active += 1
+            else:
+                batch.append(item)
+                if len(batch) >= self.size:
+                    self._cond.notify_all()
+
+        if leader:
+            try:
+                self._run(batch, timeout)
+            finally:
+                with self._cond:
+                    self.active -= 1
+                    self._cond.notify_all()
+        else:
+            item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _run(self, batch, timeout):
+        try:
+            with conversion_slots().acquire() as profile_dir:
+                metrics.CONVERSION_BATCH_SIZE.observe(len(batch))
+                if len(batch) == 1:
+                    batch[0].result = _convert_to(batch[0].folder, batch[0].source, timeout, profile_dir)
+                    return
+                results = _convert_batch([(item.folder, item.source) for item in batch], timeout, profile_dir)
+                for item, result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        item.error = result
+                    else:
+                        item.result = result
+        except Exception as e:
+            for item in batch:
+                if item.result is None and item.error is None:
+                    item.error = e
+        finally:
+            for item in batch:
+                item.done.set()
+
+def libreoffice_exec():
+    if os.environ.get('DOC_SOFFICE'):
+        return os.environ['DOC_SOFFICE']
+    if sys.platform == 'darwin':
+        return '/Applications/LibreOffice.app/Contents/MacOS/soffice'
+    elif sys.platform == 'win32':
+        return r'C:\Program Files\LibreOffice\program\soffice.exe'
+    return 'libreoffice'
+
+def _props(**kwargs):
+    return tuple(PropertyValue(Name=name, Value=value) for name, value in kwargs.items())
+
+class OfficeInstance:
+    """
+    One headless LibreOffice process with its own profile directory, reached over a UNO pipe.
+    """
+    def __init__(self, index):
+        self.index = index
+        self.pipe_name = f'docgen-{os.getpid()}-{index}'
+        self.process = None
+        self.profile_dir = None
+        self.desktop = None
+        self.conversions = 0
+
+    def start(self):
+        self.profile_dir = get_scratch().mkdtemp(prefix='docgen-lo-', admit=False)
+        args = [
+            libreoffice_exec(), '--headless', '--invisible', '--nologo', '--norestore', '--nodefault',
+            f'-env:UserInstallation={Path(self.profile_dir).as_uri()}',
+            f'--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext',
+        ]
+        self.process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                        start_new_session=True)
+        self.conversions = 0
+
+        local_ctx = uno.getComponentContext()
+        resolver = local_ctx.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local_ctx)
+        url = f'uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext'
+        deadline = time.monotonic() + START_TIMEOUT
+        while True:
+            try:
+                ctx = resolver.resolve(url)
+                break
+            except Exception:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"LibreOffice instance {self.index} failed to start.")
+                time.sleep(0.1)
+        self.desktop = ctx.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', ctx)
+
+    def healthy(self):
+        if self.process is None or self.process.poll() is not None or self.desktop is None:
+            return False
+        try:
+            self.desktop.getCurrentComponent()
+            return True
+        except Exception:
+            return False
+
+    def convert(self, folder, source, timeout=CONVERT_TIMEOUT):
+        """
+        Convert source to PDF in folder. A watchdog kills the instance's process group if the
+        conversion is still running after timeout seconds, which makes the UNO call fail.
+        """
+        target = os.path.join(folder, os.path.splitext(os.path.basename(source))[0] + '.pdf')
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            kill_process_group(self.process)
+
+        watchdog = threading.Timer(timeout, expire)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            doc = self.desktop.loadComponentFromURL(
+                uno.systemPathToFileUrl(os.path.abspath(source)), '_blank', 0, _props(Hidden=True, ReadOnly=True))
+            if doc is None:
+                raise ConversionFailed(f"LibreOffice could not open {os.path.basename(source)}.")
+            try:
+                doc.storeToURL(uno.systemPathToFileUrl(os.path.abspath(target)), _props(FilterName='writer_pdf_Export'))
+            finally:
+                doc.close(True)
+        except Exception:
+            if expired.is_set():
+                raise ConversionTimeout(f"PDF conversion did not finish within {timeout:g} seconds.")
+            raise
+        finally:
+            watchdog.cancel()
+        self.conversions += 1
+        return os.path.basename(target)
+
+    def stop(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                kill_process_group(self.process)
+                self.process.wait()
+            self.process = None
+        if self.profile_dir:
+            get_scratch().remove(self.profile_dir)
+            self.profile_dir = None
+
+class OfficePool:
+    """
+    Fixed-size pool of OfficeInstance objects. Instances are started lazily, health checked
+    on checkout and recycled after max_conversions documents or any failed conversion.
+    """
+    def __init__(self, size=POOL_SIZE, max_conversions=MAX_CONVERSIONS):
+        self.size = size
+        self.max_conversions = max_conversions
+        self._idle = queue.LifoQueue()
+        self._instances = [OfficeInstance(i) for i in range(size)]
+        for instance in self._instances:
+            self._idle.put(instance)
+
+    @contextmanager
+    def instance(self, timeout=ACQUIRE_TIMEOUT):
+        try:
+            instance = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No LibreOffice instance available.")
+        try:
+            if not instance.healthy():
+                instance.stop()
+                instance.start()
+            yield instance
+        except Exception:
+            instance.stop()
+            raise
+        finally:
+            if instance.conversions >= self.max_conversions:
+                instance.stop()
+            self._idle.put(instance)
+
+    def convert(self, folder, source, timeout=CONVERT_TIMEOUT, fresh=False):
+        with self.instance() as instance:
+            if fresh and instance.conversions:
+                instance.stop()
+                instance.start()
+            return instance.convert(folder, source, timeout)
+
+    def shutdown(self):
+        for instance in self._instances:
+            instance.stop()
+
+_pool = None
+_slots = None
+_batcher = None
+_pool_lock = threading.Lock()
+
+def pool_enabled():
+    return uno is not None and POOL_SIZE > 0
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OfficePool()
+            atexit.register(_pool.shutdown)
+        return _pool
+
+def prewarm(folder, source):
+    """
+    Convert source once on every pool instance, starting them all. Without the pool, convert it
+    with a one-shot soffice run on every conversion slot whose user profile does not exist yet,
+    so no request pays for LibreOffice creating one; slots busy elsewhere (another worker
+    warming them) are skipped. If every profile exists already, one conversion still warms
+    the executable. The pool bypasses the conversion slots.
+    Returns True if every conversion produced a PDF.
+    """
+    if not pool_enabled():
+        slots = conversion_slots()
+        results = []
+        for index in range(slots.limit):
+            if os.path.isdir(slots.profile_dir(index)):
+                continue
+            with slots.hold(index) as profile_dir:
+                if profile_dir is not None:
+                    results.append(bool(_convert_once(folder, source, CONVERT_TIMEOUT, profile_dir)))
+        if not results:
+            with slots.acquire() as profile_dir:
+                results.append(bool(_convert_once(folder, source, CONVERT_TIMEOUT, profile_dir)))
+        return all(results)
+    pool = get_pool()
+    with ExitStack() as stack:
+        instances = [stack.enter_context(pool.instance()) for _ in range(pool.size)]
+        return all(instance.convert(folder, source) for instance in instances)
+
+def conversion_slots():
+    global _slots
+    with _pool_lock:
+        if _slots is None:
+            _slots = ConversionSlots()
+        return _slots
+
+def conversion_batcher():
+    global _batcher
+    with _pool_lock:
+        if _batcher is None:
+            _batcher = ConversionBatcher()
+        return _batcher
+
+def batching_enabled():
+    return not pool_enabled() and BATCH_WINDOW > 0 and BATCH_SIZE > 1
+
+def convert_to(folder, source, timeout=None):
+    """
+    Convert source to PDF in folder within timeout (DOC_CONVERT_TIMEOUT) seconds and return the
+    PDF filename; raises ConversionFailed saying why when no PDF was produced (see supervised()).
+    Without the pool, concurrent calls are batched into one soffice run (see ConversionBatcher).
+    Raises ConversionBusy when every conversion slot stays taken or the circuit breaker is open.
+    """
+    if batching_enabled():
+        return conversion_batcher().convert(folder, source, timeout)
+    with conversion_slots().acquire() as profile_dir:
+        return _convert_to(folder, source, timeout, profile_dir)
+
+def _convert_to(folder, source, timeout, profile_dir=None, allow=True):
+    timeout = timeout if timeout is not None else CONVERT_TIMEOUT
+    if pool_enabled():
+        return supervised(get_pool().convert, folder, source, timeout, allow=allow)
+    return supervised(_convert_once, folder, source, timeout, profile_dir, allow=allow)
+
+def _convert_once(folder, source, timeout, profile_dir=None, fresh=False):
+    """
+    One one-shot soffice conversion using the user profile in profile_dir (the conversion
+    slot's); fresh runs it with a new, private profile instead.
+    """
+    fresh_dir = get_scratch().mkdtemp(prefix='docgen-lo-', admit=False) if fresh else None
+    try:
+        returncode, stdout, stderr = run_soffice(one_shot_args(folder, [source], fresh_dir or profile_dir), timeout)
+    finally:
+        if fresh_dir:
+            get_scratch().remove(fresh_dir)
+    filename = re.search(r'-> (.*?) using filter', stdout)
+    if filename:
+        return filename.group(1)
+    detail = (stderr.strip() or stdout.strip())[-500:]
+    if returncode != 0:
+        raise ConversionCrashed(f"LibreOffice exited with status {returncode}: {detail}")
+    raise ConversionFailed(f"LibreOffice did not convert the document: {detail or 'no output'}")
+
+def convert_many(folder, sources, timeout=None):
+    """
+    Convert several documents to PDF with a single soffice run, or, with the pool, one pool
+    checkout per document, so each is supervised and retried on its own and other requests
+    can use the instances in between. Returns a dict mapping each source to its PDF filename,
+    or to the exception (ConversionFailed saying why) if that file failed. Sources must have
+    distinct base names. The whole call holds one conversion slot; timeout applies per document.
+    """
+    with conversion_slots().acquire() as profile_dir:
+        return _convert_many(folder, sources, timeout, profile_dir)
+
+def _convert_many(folder, sources, timeout, profile_dir=None):
+    timeout = timeout if timeout is not None else CONVERT_TIMEOUT
+    if not pool_enabled():
+        return _convert_run(folder, sources, timeout, profile_dir)
+    results = {}
+    for source in sources:
+        try:
+            results[source] = supervised(get_pool().convert, folder, source, timeout)
+        except ConversionBusy:
+            raise
+        except Exception as e:
+            results[source] = e
+    return results
+
+def _pdf_name(source):
+    return os.path.splitext(os.path.basename(source))[0] + '.pdf'
+
+def _convert_many_once(folder, sources, timeout, profile_dir=None):
+    """
+    One soffice run over sources, each document getting timeout seconds from when the previous
+    one finished. Returns ({source: PDF filename, or ConversionFailed with LibreOffice's message
+    about that file}, the ConversionTimeout or ConversionCrashed that ended the run early, or None).
+    """
+    def finished():
+        return sum(os.path.exists(os.path.join(folder, _pdf_name(source))) for source in sources)
+
+    failure = None
+    stderr = ''
+    try:
+        returncode, _, stderr = run_soffice(one_shot_args(folder, sources, profile_dir), timeout, progress=finished)
+        if returncode != 0:
+            failure = ConversionCrashed(f"LibreOffice exited with status {returncode}: {stderr.strip()[-500:]}")
+    except ConversionTimeout as e:
+        failure = e
+    results = {}
+    for source in sources:
+        filename = _pdf_name(source)
+        if os.path.exists(os.path.join(folder, filename)):
+            results[source] = filename
+            continue
+        mentions = re.compile(r'(?:^|[\\/\s])' + re.escape(os.path.basename(source)) + r'\b')
+        lines = [line for line in stderr.splitlines() if mentions.search(line)] or stderr.strip().splitlines()
+        detail = '\n'.join(lines)[-500:]
+        results[source] = ConversionFailed(f"LibreOffice did not convert the document: {detail or 'no output'}")
+    return results, failure
+
+def _convert_run(folder, sources, timeout, profile_dir=None):
+    """
+    Convert sources with one soffice run under the circuit breaker. A file LibreOffice refuses
+    fails on its own with its message. If the run times out or crashes, the documents it did
+    not convert are converted again one at a time with _convert_to, the one it stopped at
+    last, so a bad file only fails (and only holds up) its own conversion. The run settles the
+    breaker (and a half-open breaker's trial) whatever happens; the one-at-a-time conversions
+    were let through with it and do not ask the breaker again.
+    """
+    breaker.allow()
+    failure = None
+    try:
+        results, failure = _convert_many_once(folder, sources, timeout, profile_dir)
+    except BaseException as e:
+        # soffice could not be started at all (OSError) or the worker is being torn down.
+        failure = e
+        metrics.CONVERSION_ATTEMPTS.inc(outcome='error')
+        raise
+    finally:
+        if failure is None:
+            breaker.success()
+        else:
+            breaker.failure()
+    if failure is None:
+        metrics.CONVERSION_ATTEMPTS.inc(outcome='ok')
+        return results
+    metrics.CONVERSION_ATTEMPTS.inc(outcome='timeout' if isinstance(failure, ConversionTimeout) else 'crash')
+    converted = [isinstance(results[source], str) for source in sources]
+    culprit = converted.index(False) if not all(converted) else None
+    if culprit != 0 and any(converted):
+        # soffice converts in order: the last PDF it wrote before dying may be incomplete.
+        converted[(culprit if culprit is not None else len(converted)) - 1] = False
+    retry = [i for i, done in enumerate(converted) if not done and i != culprit]
+    for i in retry + ([culprit] if culprit is not None else []):
+        try:
+            results[sources[i]] = _convert_to(folder, sources[i], timeout, profile_dir, allow=False)
+        except Exception as e:
+            results[sources[i]] = e
+    return results
+
+def _convert_batch(items, timeout, profile_dir=None):
+    """
+    Convert (folder, source) pairs with _convert_run. Sources are linked into a private
+    directory under unique names, so callers may all use the same file name, and each PDF is
+    moved back to its caller's folder. Returns, in order, each PDF filename or the exception
+    that file failed with.
+    """
+    timeout = timeout if timeout is not None else CONVERT_TIMEOUT
+    with get_scratch().workdir('docgen-batch-', admit=False) as batch_dir:
+        sources = []
+        for i, (folder, source) in enumerate(items):
+            linked = os.path.join(batch_dir, f'{i}{os.path.splitext(source)[1]}')
+            try:
+                os.link(source, linked)
+            except OSError:
+                shutil.copyfile(source, linked)
+            sources.append(linked)
+        converted = _convert_run(batch_dir, sources, timeout, profile_dir)
+        results = []
+        for (folder, source), linked in zip(items, sources):
+            result = converted[linked]
+            if isinstance(result, str):
+                shutil.move(os.path.join(batch_dir, result), os.path.join(folder, _pdf_name(source)))
+                result = _pdf_name(source)
+            results.append(result)
+        return results
@@ -0,0 +1,169 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import fastjson
+
+MEMORY_BYTES = int(os.environ.get('DOC_OUTPUT_CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+MEMORY_ITEM_BYTES = int(os.environ.get('DOC_OUTPUT_CACHE_MEMORY_ITEM_BYTES', str(4 * 1024 * 1024)))
+DISK_BYTES = int(os.environ.get('DOC_OUTPUT_CACHE_DISK_BYTES', str(1024 * 1024 * 1024)))
+CACHE_DIR = os.environ.get('DOC_OUTPUT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'docgen-output-cache'))
+
+MIMETYPES = {
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+}
+
+def output_ext(doc_type):
+    # generate_document() produces DOCX for anything that is not another known format.
+    doc_type = doc_type.lower()
+    return doc_type if doc_type in MIMETYPES else 'docx'
+
+def canonical_json(data):
+    return fastjson.canonical_dumps(data)
+
+def output_key(template_sha256, data_json, doc_type):
+    """
+    Content address of a generated document: template hash, canonical JSON of the data
+    (see canonical_json()) and doc_type.
+    """
+    h = hashlib.sha256()
+    h.update((template_sha256 or 'skeleton').encode())
+    h.update(b'\0')
+    h.update(data_json)
+    h.update(b'\0')
+    h.update(output_ext(doc_type).encode())
+    return h.hexdigest()
+
+class OutputCache:
+    """
+    Two-tier LRU cache of generated documents. Small outputs are kept in memory; every output is
+    also written to cache_dir, where the least recently used files are evicted past disk_bytes.
+    """
+    def __init__(self, memory_bytes=MEMORY_BYTES, disk_bytes=DISK_BYTES, cache_dir=CACHE_DIR,
+                 memory_item_bytes=MEMORY_ITEM_BYTES):
+        self.memory_bytes = memory_bytes
+        self.memory_item_bytes = memory_item_bytes
+        self.disk_bytes = disk_bytes
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self._disk_size = 0
+        if disk_bytes > 0:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk_size = sum(size for _, _, size in self._disk_entries())
+
+    @property
+    def enabled(self):
+        return self.memory_bytes > 0 or self.disk_bytes > 0
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, f'{key}.{ext}')
+
+    def _disk_entries(self):
+        entries = []
+        for entry in os.listdir(self.cache_dir):
+            name, _, ext = entry.partition('.')
+            if ext not in MIMETYPES:
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, entry))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, entry, st.st_size))
+        return entries
+
+    def get(self, key, doc_type):
+        """
+        Return (BytesIO or path, mimetype, filename) for a cached output, or None.
+        """
+        ext = output_ext(doc_type)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return BytesIO(data), MIMETYPES[ext], f'output.{ext}'
+
+        if self.disk_bytes > 0:
+            path = self._path(key, ext)
+            try:
+                os.utime(path)
+                size = os.path.getsize(path)
+                result = path
+                if size <= self.memory_item_bytes:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    self._remember(key, data)
+                    result = BytesIO(data)
+            except FileNotFoundError:
+                pass
+            else:
+                with self._lock:
+                    self.hits += 1
+                return result, MIMETYPES[ext], f'output.{ext}'
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put_file(self, key, doc_type, path):
+        """
+        Cache the document at path. The disk tier hard-links the file when it is on the same
+        filesystem, so caching does not copy the document.
+        """
+        ext = output_ext(doc_type)
+        size = os.path.getsize(path)
+        if size <= self.memory_item_bytes:
+            with open(path, 'rb') as f:
+                self._remember(key, f.read())
+        if self.disk_bytes > 0 and size <= self.disk_bytes:
+            tmp_path = os.path.join(self.cache_dir, f'{key}.{os.getpid()}.{threading.get_ident()}.tmp')
+            try:
+                os.link(path, tmp_path)
+            except OSError:
+                shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, self._path(key, ext))
+            with self._lock:
+                self._disk_size += size
+                evict = self._disk_size > self.disk_bytes
+            if evict:
+                self._evict_disk()
+
+    def _remember(self, key, data):
+        if self.memory_bytes <= 0 or len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    def _evict_disk(self):
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, _, size in entries)
+        for _, entry, size in entries:
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self.cache_dir, entry))
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self._lock:
+            self._disk_size = total
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'memory_items': len(self._memory),
+                    'memory_bytes': self._memory_size, 'disk_bytes': self._disk_size}
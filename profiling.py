@@ -0,0 +1,164 @@
+import io
+import os
+import re
+import sys
+import hmac
+import time
+import uuid
+import pstats
+import cProfile
+import tempfile
+import threading
+import tracemalloc
+from collections import Counter
+
+PROFILE_TOKEN = os.environ.get('DOC_PROFILE_TOKEN', '')
+PROFILE_DIR = os.environ.get('DOC_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'docgen-profiles'))
+PROFILE_KEEP = int(os.environ.get('DOC_PROFILE_KEEP', '50'))
+PROFILE_ALLOCATIONS = os.environ.get('DOC_PROFILE_ALLOCATIONS', '1') != '0'
+SAMPLE_INTERVAL = float(os.environ.get('DOC_PROFILE_SAMPLE_INTERVAL', '0.005'))
+
+# Files written per profile: cProfile stats (snakeviz, gprof2dot, `python -m pstats`), sampled
+# stacks in the folded format of flamegraph.pl and speedscope, and a plain-text summary.
+PROFILE_FILES = {
+    'pstats': 'application/octet-stream',
+    'folded': 'text/plain',
+    'txt': 'text/plain',
+}
+
+_ID_RE = re.compile(r'^\d{8}T\d{6}-[0-9a-f]{8}$')
+_active = threading.Lock()
+
+class ProfilerBusy(Exception):
+    pass
+
+def enabled():
+    return bool(PROFILE_TOKEN)
+
+def authorized(token):
+    return enabled() and bool(token) and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+class StackSampler:
+    """
+    Samples the stack of one thread every `interval` seconds from a background thread and counts
+    identical stacks, which is what flame graphs are drawn from.
+    """
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='doc-profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+class RequestProfile:
+    """
+    Profiles the calling thread between start() and stop(): deterministic cProfile timings,
+    sampled stacks and, unless DOC_PROFILE_ALLOCATIONS=0, tracemalloc allocation sites. Only one
+    request is profiled at a time (cProfile and tracemalloc are process-wide); tracemalloc also
+    sees allocations of other threads running meanwhile.
+    """
+    def __init__(self, label, profile_dir=PROFILE_DIR, allocations=PROFILE_ALLOCATIONS):
+        self.label = label
+        self.profile_dir = profile_dir
+        self.allocations = allocations
+        self.profile_id = f'{time.strftime("%Y%m%dT%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        self._profiler = cProfile.Profile()
+        self._sampler = StackSampler(threading.get_ident())
+        self._started_tracemalloc = False
+        self._start = None
+
+    def start(self):
+        if not _active.acquire(blocking=False):
+            raise ProfilerBusy("Another request is being profiled.")
+        if self.allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            self._started_tracemalloc = True
+        self._sampler.start()
+        self._start = time.perf_counter()
+        self._profiler.enable()
+        return self
+
+    def stop(self):
+        """
+        Stop profiling and write the profile files; returns the profile ID.
+        """
+        try:
+            self._profiler.disable()
+            seconds = time.perf_counter() - self._start
+            self._sampler.stop()
+            snapshot = None
+            if self._started_tracemalloc:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        finally:
+            _active.release()
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        base = os.path.join(self.profile_dir, self.profile_id)
+        self._profiler.dump_stats(base + '.pstats')
+        with open(base + '.folded', 'w') as f:
+            f.write(self._sampler.folded())
+
+        summary = io.StringIO()
+        summary.write(f'{self.label}\n{seconds:.3f} s\n\n')
+        pstats.Stats(self._profiler, stream=summary).sort_stats('cumulative').print_stats(40)
+        if snapshot is not None:
+            summary.write(f'Peak traced memory: {peak / (1024 * 1024):.1f} MiB\n\nTop allocation sites:\n')
+            for stat in snapshot.statistics('lineno')[:30]:
+                summary.write(f'{stat}\n')
+        with open(base + '.txt', 'w') as f:
+            f.write(summary.getvalue())
+        _prune(self.profile_dir)
+        return self.profile_id
+
+def _prune(profile_dir, keep=PROFILE_KEEP):
+    ids = list_profiles(profile_dir)
+    for profile_id in ids[keep:]:
+        for ext in PROFILE_FILES:
+            try:
+                os.unlink(os.path.join(profile_dir, f'{profile_id}.{ext}'))
+            except FileNotFoundError:
+                pass
+
+def list_profiles(profile_dir=PROFILE_DIR):
+    """
+    IDs of saved profiles, newest first.
+    """
+    if not os.path.isdir(profile_dir):
+        return []
+    ids = {name.rpartition('.')[0] for name in os.listdir(profile_dir)}
+    return sorted((i for i in ids if _ID_RE.match(i)), reverse=True)
+
+def profile_path(profile_id, ext, profile_dir=PROFILE_DIR):
+    """
+    Path of one file of a saved profile, or None if there is no such profile or file.
+    """
+    if not _ID_RE.match(profile_id) or ext not in PROFILE_FILES:
+        return None
+    path = os.path.join(profile_dir, f'{profile_id}.{ext}')
+    return path if os.path.exists(path) else None
@@ -0,0 +1,184 @@
+import os
+import re
+import shutil
+import zipfile
+from io import BytesIO
+
+import jinja2
+from docxtpl import DocxTemplate, InlineImage
+
+from images import is_image_ref
+from introspect import TemplateSchema
+
+from template_cache import template_hash
+
+# Core properties docxtpl renders as templates (see DocxTemplate.render_properties).
+CORE_PROPERTIES = ['author', 'comments', 'identifier', 'language', 'subject', 'title']
+
+STREAM_CHUNK_CHARS = int(os.environ.get('DOC_STREAM_CHUNK_CHARS', str(1024 * 1024)))
+EMPTY_BODY = '<w:body xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"/>'
+DOCPR_ID_RE = re.compile(r'(<wp:docPr\b[^>]*?\bid=")[^"]*(")')
+# Table cell loops and colspan change the cell count of rows, which docxtpl fixes up on the whole
+# parsed body (fix_tables); templates using them are always rendered in one piece.
+CELL_TAG_RE = re.compile(r'\{%-?\s*(?:tc\s|colspan\b)')
+# Context key under which the rendering CachedDocxTemplate is passed to finalize_value().
+TEMPLATE_KEY = '__docgen_template__'
+
+@jinja2.pass_context
+def finalize_value(context, value):
+    """
+    Jinja finalize hook: image references from data ({"$image": ...} or {"$image_id": ...})
+    are output as inline images, everything else unchanged.
+    """
+    if is_image_ref(value):
+        template = context.get(TEMPLATE_KEY)
+        if template is not None:
+            return template.inline_image(value)
+    return value
+
+class CompiledTemplate:
+    """
+    A .docx template with the body, header and footer XML already pre-processed by docxtpl
+    and compiled by Jinja, so renders only have to evaluate the templates. schema describes
+    the data the template reads, collected from the same ASTs the templates are compiled from.
+    """
+    def __init__(self, data, jinja_env=None):
+        self.data = data
+        self.sha256 = template_hash(data)
+        self.jinja_env = jinja_env or jinja2.Environment(finalize=finalize_value)
+        self.schema = TemplateSchema(self.jinja_env.globals)
+
+        tpl = DocxTemplate(BytesIO(data))
+        tpl.init_docx()
+        body = tpl.get_xml()
+        self.streamable = not CELL_TAG_RE.search(re.sub(r'<[^>]+>', '', body))
+        self.body = self._compile(tpl.patch_xml(body), 'body')
+        self.parts = {}
+        for uri, kind in ((DocxTemplate.HEADER_URI, 'header'), (DocxTemplate.FOOTER_URI, 'footer')):
+            for rel_key, part in tpl.get_headers_footers(uri):
+                xml = tpl.get_part_xml(part)
+                encoding = tpl.get_headers_footers_encoding(xml)
+                self.parts[rel_key] = (encoding, self._compile(tpl.patch_xml(xml), kind))
+        self.properties = {
+            prop: self._from_source(getattr(tpl.docx.core_properties, prop) or '', 'properties')
+            for prop in CORE_PROPERTIES
+        }
+
+    def _compile(self, xml, part):
+        return self._from_source(re.sub(r'<w:p([ >])', r'\n<w:p\1', xml), part)
+
+    def _from_source(self, source, part):
+        ast = self.jinja_env.parse(source)
+        self.schema.add(part, ast)
+        return self.jinja_env.from_string(ast)
+
+class CachedDocxTemplate(DocxTemplate):
+    """
+    DocxTemplate that renders from a CompiledTemplate instead of re-reading and recompiling the XML.
+    """
+    def __init__(self, compiled, images=None):
+        super().__init__(BytesIO(compiled.data))
+        self.compiled = compiled
+        self.images = images
+        self.body_rendered = False
+
+    def inline_image(self, ref):
+        if self.images is None:
+            raise ValueError("Images are not supported here.")
+        prepared = self.images.get(ref)
+        return InlineImage(self, BytesIO(prepared.blob), prepared.width, prepared.height)
+
+    def render(self, context, jinja_env=None, autoescape=False):
+        if self.images is not None and isinstance(context, dict):
+            context = dict(context, **{TEMPLATE_KEY: self})
+        super().render(context, jinja_env, autoescape)
+
+    def finish_xml(self, xml):
+        xml = re.sub(r'\n<w:p([ >])', r'<w:p\1', xml)
+        xml = xml.replace('{_{', '{{').replace('}_}', '}}').replace('{_%', '{%').replace('%_}', '%}')
+        return self.resolve_listing(xml)
+
+    def render_compiled_part(self, template, part, context):
+        self.current_rendering_part = part
+        return self.finish_xml(template.render(context))
+
+    def build_xml(self, context, jinja_env=None):
+        if self.body_rendered:
+            return EMPTY_BODY
+        return self.render_compiled_part(self.compiled.body, self.docx._part, context)
+
+    def stream_body(self, context, out):
+        """
+        Render the body into the binary file out piece by piece: Jinja output is post-processed
+        and written every STREAM_CHUNK_CHARS characters, cut after a closing paragraph, so neither
+        the whole XML string nor its tree is ever built. docPr IDs are renumbered as
+        fix_docpr_ids() would; fix_tables() is skipped, see CompiledTemplate.streamable.
+        """
+        self.render_init()
+        self.current_rendering_part = self.docx._part
+        if self.images is not None and isinstance(context, dict):
+            context = dict(context, **{TEMPLATE_KEY: self})
+        pending = []
+        size = 0
+        for text in self.compiled.body.generate(context):
+            pending.append(text)
+            size += len(text)
+            if size < STREAM_CHUNK_CHARS:
+                continue
+            xml = ''.join(pending)
+            cut = xml.rfind('</w:p>')
+            if cut < 0:
+                pending = [xml]
+                continue
+            cut += len('</w:p>')
+            out.write(self._finish_chunk(xml[:cut]).encode())
+            pending = [xml[cut:]]
+            size = len(pending[0])
+        out.write(self._finish_chunk(''.join(pending)).encode())
+        self.body_rendered = True
+
+    def _finish_chunk(self, xml):
+        def renumber(m):
+            self.docx_ids_index += 1
+            return f'{m.group(1)}{self.docx_ids_index}{m.group(2)}'
+        return DOCPR_ID_RE.sub(renumber, self.finish_xml(xml))
+
+    def render_streamed(self, context, path):
+        """
+        Render with the body streamed to disk (stream_body) and save the document to path.
+        Headers, footers, properties and relationships go through docxtpl as usual, with an
+        empty body; word/document.xml is then assembled around the streamed body.
+        """
+        body_path = path + '.body'
+        parts_path = path + '.parts'
+        try:
+            with open(body_path, 'wb') as out:
+                self.stream_body(context, out)
+            self.render(context)
+            self.save(parts_path)
+            with zipfile.ZipFile(parts_path) as source, \
+                    zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as target:
+                for info in source.infolist():
+                    if info.filename != 'word/document.xml':
+                        target.writestr(info, source.read(info))
+                        continue
+                    head, tail = source.read(info).split(b'<w:body/>', 1)
+                    with target.open('word/document.xml', 'w', force_zip64=True) as document, \
+                            open(body_path, 'rb') as body:
+                        document.write(head)
+                        shutil.copyfileobj(body, document, STREAM_CHUNK_CHARS)
+                        document.write(tail)
+        finally:
+            for leftover in (body_path, parts_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        return path
+
+    def build_headers_footers_xml(self, context, uri, jinja_env=None):
+        for rel_key, part in self.get_headers_footers(uri):
+            encoding, template = self.compiled.parts[rel_key]
+            yield rel_key, self.render_compiled_part(template, part, context).encode(encoding)
+
+    def render_properties(self, context, jinja_env=None):
+        for prop, template in self.compiled.properties.items():
+            setattr(self.docx.core_properties, prop, template.render(context))
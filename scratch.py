@@ -0,0 +1,196 @@
+import os
+import re
+import time
+import uuid
+import atexit
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from admission import AdmissionRejected
+
+def _default_root():
+    # /dev/shm is a tmpfs on Linux, so documents never touch the disk on their way through.
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm/docgen-scratch'
+    return os.path.join(tempfile.gettempdir(), 'docgen-scratch')
+
+SCRATCH_DIR = os.environ.get('DOC_SCRATCH_DIR') or _default_root()
+SCRATCH_FALLBACK_DIR = os.environ.get('DOC_SCRATCH_FALLBACK_DIR', os.path.join(tempfile.gettempdir(), 'docgen-scratch'))
+SCRATCH_QUOTA = int(os.environ.get('DOC_SCRATCH_QUOTA_BYTES', str(1024 * 1024 * 1024)))
+SCRATCH_USAGE_INTERVAL = float(os.environ.get('DOC_SCRATCH_USAGE_INTERVAL', '1'))
+SCRATCH_MIN_FREE = int(os.environ.get('DOC_SCRATCH_MIN_FREE_BYTES', str(256 * 1024 * 1024)))
+SCRATCH_MAX_AGE = float(os.environ.get('DOC_SCRATCH_MAX_AGE', '3600'))
+
+_DIR_RE = re.compile(r'-(\d+)-[0-9a-f]{8}$')
+
+# LibreOffice profiles live as long as their instance, so only a dead owner makes them orphans.
+PERSISTENT_PREFIXES = ('docgen-lo-',)
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class ScratchFull(AdmissionRejected):
+    """
+    Raised instead of creating a working directory while scratch space is over its quota.
+    """
+
+def _tree_size(path):
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(folder, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+class Scratch:
+    """
+    Per-request working directories on a fast volume (tmpfs by default). While the volume holding
+    root has less than min_free bytes free, new ones are made in fallback_dir on disk instead.
+    While root and fallback_dir together hold quota bytes or more, new work is refused with
+    ScratchFull; their size comes from a walk of both trees at most usage_interval seconds old,
+    shared by all requests in between. Directory names carry the owning PID, so sweep() can remove those left behind by workers
+    that crashed or were killed; directories older than max_age are removed regardless (except
+    LibreOffice profiles), and a process removes its own at exit.
+    """
+    def __init__(self, root=SCRATCH_DIR, fallback_dir=SCRATCH_FALLBACK_DIR, quota=SCRATCH_QUOTA,
+                 usage_interval=SCRATCH_USAGE_INTERVAL, min_free=SCRATCH_MIN_FREE, max_age=SCRATCH_MAX_AGE):
+        self.root = root
+        self.fallback_dir = fallback_dir
+        self.quota = quota
+        self.usage_interval = usage_interval
+        self.min_free = min_free
+        self.max_age = max_age
+        self.fallbacks = 0
+        self.rejected = 0
+        self.swept = 0
+        self._dirs = set()
+        self._lock = threading.Lock()
+        self._usage = 0
+        self._usage_at = None
+        self._usage_lock = threading.Lock()
+        atexit.register(self.remove_all)
+
+    def check(self):
+        """
+        Raise ScratchFull while root and fallback_dir hold quota bytes or more.
+        """
+        if self.quota > 0 and self.usage() >= self.quota:
+            with self._lock:
+                self.rejected += 1
+            raise ScratchFull("Scratch space is full, retry later.")
+
+    def mkdtemp(self, prefix='docgen-', admit=True):
+        """
+        Create a working directory and return its path; remove it with remove(). admit=False skips
+        the quota check, for directories of work that was already let in (LibreOffice profiles,
+        conversion batches), which must not fail halfway.
+        """
+        if admit:
+            self.check()
+        parent = self.root
+        if self.min_free > 0 and self.fallback_dir != self.root and self.free() < self.min_free:
+            parent = self.fallback_dir
+            with self._lock:
+                self.fallbacks += 1
+        os.makedirs(parent, exist_ok=True)
+        path = os.path.join(parent, f'{prefix}{os.getpid()}-{uuid.uuid4().hex[:8]}')
+        os.mkdir(path, 0o700)
+        with self._lock:
+            self._dirs.add(path)
+        return path
+
+    def remove(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            self._dirs.discard(path)
+
+    @contextmanager
+    def workdir(self, prefix='docgen-', admit=True):
+        path = self.mkdtemp(prefix, admit)
+        try:
+            yield path
+        finally:
+            self.remove(path)
+
+    def remove_all(self):
+        with self._lock:
+            paths = list(self._dirs)
+        for path in paths:
+            self.remove(path)
+
+    def usage(self):
+        """
+        Bytes held in root and fallback_dir by all processes, walked at most every usage_interval seconds.
+        """
+        with self._usage_lock:
+            now = time.monotonic()
+            if self._usage_at is None or now - self._usage_at >= self.usage_interval:
+                self._usage = sum(_tree_size(parent) for parent in {self.root, self.fallback_dir}
+                                  if os.path.isdir(parent))
+                self._usage_at = now
+            return self._usage
+
+    def free(self):
+        """
+        Bytes available on the volume holding root; one statvfs() call, not a walk of the tree.
+        """
+        path = self.root if os.path.isdir(self.root) else os.path.dirname(self.root)
+        try:
+            st = os.statvfs(path)
+        except (OSError, AttributeError):
+            return float('inf')
+        return st.f_bavail * st.f_frsize
+
+    def sweep(self):
+        """
+        Remove working directories whose process is gone or that are older than max_age.
+        Returns how many were removed.
+        """
+        removed = 0
+        now = time.time()
+        for parent in {self.root, self.fallback_dir}:
+            if not os.path.isdir(parent):
+                continue
+            for entry in os.listdir(parent):
+                match = _DIR_RE.search(entry)
+                if not match:
+                    continue
+                path = os.path.join(parent, entry)
+                try:
+                    expired = (not entry.startswith(PERSISTENT_PREFIXES)
+                               and now - os.path.getmtime(path) > self.max_age)
+                except FileNotFoundError:
+                    continue
+                if expired or not pid_alive(int(match.group(1))):
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+        with self._lock:
+            self.swept += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            active = len(self._dirs)
+        return {'root': self.root, 'bytes': self.usage(), 'quota': self.quota, 'free': self.free(),
+                'min_free': self.min_free, 'active': active,
+                'fallbacks': self.fallbacks, 'rejected': self.rejected, 'swept': self.swept}
+
+_scratch = None
+_scratch_lock = threading.Lock()
+
+def get_scratch():
+    global _scratch
+    with _scratch_lock:
+        if _scratch is None:
+            _scratch = Scratch()
+        return _scratch
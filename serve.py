@@ -0,0 +1,62 @@
+"""
+Production entry point: runs app.py under gunicorn with one worker process per CPU.
+
+    python3 serve.py
+
+The app and its lazily imported modules are loaded once in the master and forked (preload), so
+workers start with docxtpl, python-docx, lxml and Jinja already imported. Each worker then warms
+LibreOffice in the background and reports ready on /ready once that is done. Concurrent PDF
+conversions across all workers are capped by DOC_MAX_CONCURRENT_CONVERSIONS (see
+office.ConversionSlots).
+"""
+import os
+
+from gunicorn.app.base import BaseApplication
+
+from office import CONVERT_TIMEOUT
+
+BIND = os.environ.get('DOC_BIND', '0.0.0.0:5000')
+WORKERS = int(os.environ.get('DOC_WORKERS', str(os.cpu_count() or 1)))
+THREADS = int(os.environ.get('DOC_THREADS', '4'))
+WORKER_TIMEOUT = int(os.environ.get('DOC_WORKER_TIMEOUT', str(int(CONVERT_TIMEOUT) + 60)))
+MAX_REQUESTS = int(os.environ.get('DOC_MAX_REQUESTS', '1000'))
+
+class DocApplication(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app import app, warmup
+        warmup.load_modules()
+        return app
+
+def post_fork(server, worker):
+    from app import scratch, job_queue, warmup
+    # Also clears the working directories of a worker that was just killed for timing out.
+    scratch.sweep()
+    job_queue.sweep()
+    warmup.start()
+
+def main():
+    DocApplication({
+        'bind': BIND,
+        'workers': WORKERS,
+        'worker_class': 'gthread',
+        'threads': THREADS,
+        'preload_app': True,
+        'timeout': WORKER_TIMEOUT,
+        'graceful_timeout': 30,
+        # Recycle workers now and then instead of relying on pm2's max_memory_restart.
+        'max_requests': MAX_REQUESTS,
+        'max_requests_jitter': MAX_REQUESTS // 10,
+        'accesslog': '-',
+        'post_fork': post_fork,
+    }).run()
+
+if __name__ == '__main__':
+    main()
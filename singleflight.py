@@ -0,0 +1,162 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+INFLIGHT_DIR = os.environ.get('DOC_INFLIGHT_DIR', os.path.join(tempfile.gettempdir(), 'docgen-inflight'))
+INFLIGHT_WAIT = float(os.environ.get('DOC_INFLIGHT_WAIT', '300'))
+INFLIGHT_RESULT_TTL = float(os.environ.get('DOC_INFLIGHT_RESULT_TTL', '60'))
+
+def link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+class SingleFlight:
+    """
+    Runs identical work once at a time across the threads and worker processes of a host. The
+    first caller for a key holds <key>.lock in root with flock() while it works. Callers that have
+    to wait for the lock are counted in _locks (threads) or leave a <key>.waiting marker (other
+    processes); only then does the first caller publish its result file as <key>.<ext> for them
+    to take instead of doing the work again. Results and idle lock files are swept result_ttl seconds later. A caller
+    that waits longer than `wait` seconds does the work itself. Without fcntl only threads of the
+    same process are deduplicated.
+    """
+    def __init__(self, root=INFLIGHT_DIR, wait=INFLIGHT_WAIT, result_ttl=INFLIGHT_RESULT_TTL):
+        self.root = root
+        self.wait = wait
+        self.result_ttl = result_ttl
+        self.leaders = 0
+        self.shared = 0
+        self.published = 0
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0
+        os.makedirs(root, exist_ok=True)
+
+    @contextmanager
+    def _hold(self, key):
+        """
+        Hold the lock for key; yields whether another caller had it first.
+        """
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        deadline = time.monotonic() + self.wait
+        fd = None
+        try:
+            waited = not entry[0].acquire(blocking=False)
+            if waited and not entry[0].acquire(timeout=self.wait):
+                yield True
+                return
+            try:
+                if fcntl is not None:
+                    fd = os.open(os.path.join(self.root, f'{key}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+                    delay = 0.01
+                    while True:
+                        try:
+                            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                            break
+                        except BlockingIOError:
+                            if not waited:
+                                open(self._marker(key), 'ab').close()
+                            waited = True
+                            if time.monotonic() >= deadline:
+                                os.close(fd)
+                                fd = None
+                                break
+                            time.sleep(delay)
+                            delay = min(delay * 2, 0.2)
+                yield waited
+            finally:
+                if fd is not None:
+                    os.close(fd)
+                entry[0].release()
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def _marker(self, key):
+        return os.path.join(self.root, f'{key}.waiting')
+
+    def _has_waiters(self, key):
+        with self._lock:
+            if self._locks[key][1] > 1:
+                return True
+        return os.path.exists(self._marker(key))
+
+    def do(self, key, ext, fn, workdir):
+        """
+        Return the path of fn(workdir)'s result for key, or of a copy in workdir of the result
+        an identical call finished while this one waited.
+        """
+        result_path = os.path.join(self.root, f'{key}.{ext}')
+        with self._hold(key) as waited:
+            if waited:
+                try:
+                    if time.time() - os.path.getmtime(result_path) <= self.result_ttl:
+                        path = os.path.join(workdir, f'output.{ext}')
+                        link_or_copy(result_path, path)
+                        with self._lock:
+                            self.shared += 1
+                        return path
+                except FileNotFoundError:
+                    pass
+            path = fn(workdir)
+            # Nobody to hand the result to: skip copying it into root.
+            if self._has_waiters(key):
+                tmp_path = os.path.join(self.root, f'{key}.{os.getpid()}.{threading.get_ident()}.tmp')
+                link_or_copy(path, tmp_path)
+                os.replace(tmp_path, result_path)
+                try:
+                    os.unlink(self._marker(key))
+                except FileNotFoundError:
+                    pass
+                with self._lock:
+                    self.published += 1
+            with self._lock:
+                self.leaders += 1
+        self._sweep()
+        return path
+
+    def _sweep(self):
+        now = time.time()
+        if now - self._last_sweep < min(self.result_ttl, 60):
+            return
+        self._last_sweep = now
+        for entry in os.listdir(self.root):
+            path = os.path.join(self.root, entry)
+            try:
+                # A waiter may poll for the lock for up to `wait` seconds.
+                ttl = self.wait if entry.endswith('.waiting') else self.result_ttl
+                if now - os.path.getmtime(path) <= ttl:
+                    continue
+                if entry.endswith('.lock') and fcntl is not None:
+                    # Only remove lock files nobody holds; a racing caller at worst repeats the work.
+                    fd = os.open(path, os.O_RDWR)
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        os.unlink(path)
+                    except BlockingIOError:
+                        pass
+                    finally:
+                        os.close(fd)
+                    continue
+                os.unlink(path)
+            except OSError:
+                continue
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._locks), 'leaders': self.leaders, 'published': self.published,
+                    'shared': self.shared}
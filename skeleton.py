@@ -0,0 +1,107 @@
+import os
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+import docx
+
+MAX_DEPTH = int(os.environ.get('DOC_SKELETON_MAX_DEPTH', '64'))
+FLUSH_PARAGRAPHS = 1024
+
+DEFAULT_DOCX = os.path.join(os.path.dirname(docx.__file__), 'templates', 'default.docx')
+PARAGRAPH = '<w:p><w:r><w:t xml:space="preserve">%s</w:t></w:r></w:p>'
+# Characters outside the XML 1.0 Char production; escape() passes them through and Word
+# then refuses to open the document.
+INVALID_XML = re.compile('[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]')
+
+_default_parts = None
+
+def _load_default_parts():
+    """
+    Parts of python-docx's blank document, with word/document.xml split around the body content.
+    """
+    global _default_parts
+    if _default_parts is None:
+        with zipfile.ZipFile(DEFAULT_DOCX) as archive:
+            parts = [(info, archive.read(info)) for info in archive.infolist()]
+        document = dict((info.filename, data) for info, data in parts)['word/document.xml']
+        split = document.index(b'<w:sectPr')
+        _default_parts = parts, document[:split], document[split:]
+    return _default_parts
+
+def iter_placeholders(data, max_depth=MAX_DEPTH):
+    """
+    Yield the placeholder skeleton for a JSON structure, avoiding duplicate keys.
+    Walks the data with an explicit stack instead of recursion. A list item whose keys have
+    all been emitted already would add nothing, so it is skipped without being walked; repeated
+    list items of the same shape therefore cost one key lookup each.
+    """
+    processed = set()
+    stack = []
+
+    def push(value, parent_key, depth):
+        if depth > max_depth:
+            raise ValueError(f"JSON data is nested deeper than {max_depth} levels.")
+        opening = None
+        if parent_key and parent_key not in processed:
+            opening = f'{{#{parent_key}}}'
+            processed.add(parent_key)
+        items = iter(value.items()) if isinstance(value, dict) else iter(value)
+        stack.append((isinstance(value, dict), items, parent_key, depth))
+        return opening
+
+    if isinstance(data, (dict, list)):
+        push(data, None, 0)
+
+    while stack:
+        is_dict, items, parent_key, depth = stack[-1]
+        item = next(items, stack)
+        if item is stack:
+            stack.pop()
+            if parent_key:
+                yield f'{{/{parent_key}}}'
+            continue
+
+        if is_dict:
+            key, value = item
+            if key in processed:
+                continue
+            if isinstance(value, (dict, list)):
+                opening = push(value, key, depth + 1)
+                if opening:
+                    yield opening
+            else:
+                yield f'{{{key}}}'
+                processed.add(key)
+        elif isinstance(item, dict):
+            if processed.issuperset(item):
+                continue
+            push(item, None, depth + 1)
+        elif isinstance(item, list):
+            push(item, None, depth + 1)
+
+def write_skeleton(data, path, max_depth=MAX_DEPTH):
+    """
+    Write a DOCX with one paragraph per placeholder straight to path as WordprocessingML,
+    without building a python-docx object model. A placeholder holding a character XML cannot
+    represent raises ValueError.
+    """
+    parts, head, tail = _load_default_parts()
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for info, data_bytes in parts:
+            if info.filename != 'word/document.xml':
+                archive.writestr(info.filename, data_bytes)
+                continue
+            with archive.open('word/document.xml', 'w') as document:
+                document.write(head)
+                paragraphs = []
+                for text in iter_placeholders(data, max_depth):
+                    if INVALID_XML.search(text):
+                        raise ValueError(f"Placeholder {text!r} contains a character not allowed in XML.")
+                    paragraphs.append(PARAGRAPH % escape(text))
+                    if len(paragraphs) >= FLUSH_PARAGRAPHS:
+                        document.write(''.join(paragraphs).encode())
+                        paragraphs = []
+                document.write(''.join(paragraphs).encode())
+                document.write(tail)
+    return path
@@ -0,0 +1,49 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+TEMPLATE_CACHE_SIZE = int(os.environ.get('DOC_TEMPLATE_CACHE_SIZE', '32'))
+
+def template_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+class TemplateCache:
+    """
+    Bounded LRU cache of compiled templates keyed by the SHA-256 of the template bytes.
+    """
+    def __init__(self, maxsize=TEMPLATE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, data, compile):
+        return self.get_keyed(template_hash(data), lambda: data, compile)
+
+    def get_keyed(self, key, load, compile):
+        """
+        Look up a template whose hash is already known; load() is only called to fetch the bytes on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = compile(load())
+        if self.maxsize <= 0:
+            return entry
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,171 @@
+import os
+import re
+import uuid
+import tempfile
+import threading
+from collections import namedtuple
+
+from template_cache import template_hash
+
+STORE_DIR = os.environ.get('DOC_TEMPLATE_STORE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'template_store'))
+IMAGE_STORE_DIR = os.environ.get('DOC_IMAGE_STORE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image_store'))
+MAX_VERSIONS = int(os.environ.get('DOC_TEMPLATE_MAX_VERSIONS', '5'))
+MAX_BYTES = int(os.environ.get('DOC_TEMPLATE_STORE_MAX_BYTES', str(1024 * 1024 * 1024)))
+
+NAME_RE = re.compile(r'^[A-Za-z0-9_.-]{1,100}$')
+
+class TemplateNotFound(KeyError):
+    pass
+
+class ImageNotFound(TemplateNotFound):
+    pass
+
+class StoredTemplate(namedtuple('StoredTemplate', 'name version sha256 path size mtime')):
+    @property
+    def template_id(self):
+        return f'{self.name}@{self.version}'
+
+    def to_dict(self):
+        return {'template_id': self.template_id, 'name': self.name, 'version': self.version,
+                'sha256': self.sha256, 'size': self.size}
+
+class TemplateStore:
+    """
+    Versioned template registry on local disk. Each upload under a name becomes a new version
+    stored as <root>/<name>/<version>-<sha256>.<ext>; old versions beyond max_versions are dropped
+    and least recently used templates are evicted once the store exceeds max_bytes. The image
+    registry is an instance with its own ext, kind and not_found exception.
+    """
+    def __init__(self, root=STORE_DIR, max_versions=MAX_VERSIONS, max_bytes=MAX_BYTES,
+                 ext='docx', kind='template', not_found=TemplateNotFound):
+        self.root = root
+        self.max_versions = max_versions
+        self.max_bytes = max_bytes
+        self.ext = ext
+        self.kind = kind
+        self.not_found = not_found
+        self._file_re = re.compile(rf'^(\d+)-([0-9a-f]{{64}})\.{re.escape(ext)}$')
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _check_name(self, name):
+        if not NAME_RE.match(name) or name.startswith('.'):
+            raise ValueError(f"Invalid {self.kind} name '{name}'.")
+
+    def _versions(self, name):
+        folder = os.path.join(self.root, name)
+        try:
+            entries = os.listdir(folder)
+        except FileNotFoundError:
+            return []
+        versions = []
+        for entry in entries:
+            match = self._file_re.match(entry)
+            if not match:
+                continue
+            path = os.path.join(folder, entry)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            versions.append(StoredTemplate(name, int(match.group(1)), match.group(2), path, st.st_size, st.st_mtime))
+        return sorted(versions, key=lambda t: t.version)
+
+    def put(self, data, name=None):
+        name = name or uuid.uuid4().hex
+        self._check_name(name)
+        sha256 = template_hash(data)
+        folder = os.path.join(self.root, name)
+        os.makedirs(folder, exist_ok=True)
+
+        with self._lock:
+            versions = self._versions(name)
+            if versions and versions[-1].sha256 == sha256:
+                os.utime(versions[-1].path)
+                return versions[-1]
+
+            fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                version = versions[-1].version + 1 if versions else 1
+                while True:
+                    path = os.path.join(folder, f'{version}-{sha256}.{self.ext}')
+                    try:
+                        # link() fails instead of overwriting when another process took this version.
+                        os.link(tmp_path, path)
+                        break
+                    except FileExistsError:
+                        version += 1
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+
+            if self.max_versions > 0:
+                for old in self._versions(name)[:-self.max_versions]:
+                    self._remove(old)
+            self._evict(keep=path)
+
+        st = os.stat(path)
+        return StoredTemplate(name, version, sha256, path, st.st_size, st.st_mtime)
+
+    def get(self, template_id):
+        """
+        Resolve 'name' (latest version) or 'name@version' to a StoredTemplate.
+        """
+        name, _, version = template_id.partition('@')
+        self._check_name(name)
+        versions = self._versions(name)
+        if version:
+            versions = [t for t in versions if str(t.version) == version]
+        if not versions:
+            raise self.not_found(template_id)
+        stored = versions[-1]
+        try:
+            os.utime(stored.path)
+        except FileNotFoundError:
+            raise self.not_found(template_id)
+        return stored
+
+    def read(self, stored):
+        try:
+            with open(stored.path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise self.not_found(stored.template_id)
+
+    def list(self):
+        templates = []
+        for name in sorted(os.listdir(self.root)):
+            if NAME_RE.match(name) and not name.startswith('.'):
+                templates.extend(self._versions(name))
+        return templates
+
+    def delete(self, template_id):
+        name, _, version = template_id.partition('@')
+        self._check_name(name)
+        versions = [t for t in self._versions(name) if not version or str(t.version) == version]
+        if not versions:
+            raise self.not_found(template_id)
+        with self._lock:
+            for stored in versions:
+                self._remove(stored)
+        return versions
+
+    def _remove(self, stored):
+        try:
+            os.unlink(stored.path)
+            os.rmdir(os.path.dirname(stored.path))
+        except OSError:
+            pass
+
+    def _evict(self, keep=None):
+        templates = self.list()
+        total = sum(t.size for t in templates)
+        for stored in sorted(templates, key=lambda t: t.mtime):
+            if total <= self.max_bytes:
+                break
+            if stored.path == keep:
+                continue
+            self._remove(stored)
+            total -= stored.size
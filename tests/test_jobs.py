@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+from admission import AdmissionRejected
+from jobs import JobQueue
+from office import ConversionBusy
+
+
+def raising(error):
+    def fn(workdir):
+        raise error
+    return fn
+
+
+def finished(queue, job):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        job = queue.get(job['id'])
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job still {job['status']}")
+
+
+@pytest.mark.parametrize('error, code, retry_after', [
+    (ConversionBusy("All conversion slots are busy.", status=429, retry_after=3), 429, 3),
+    (AdmissionRejected("Over the memory budget.", status=503, retry_after=5), 503, 5),
+    (AdmissionRejected("Larger than the whole budget.", status=413, retry_after=None), 413, None),
+    (ValueError("Bad data."), 400, None),
+    (RuntimeError("Boom."), 500, None),
+])
+def test_failed_job_keeps_the_synchronous_status(tmp_path, error, code, retry_after):
+    queue = JobQueue(result_dir=str(tmp_path))
+    job = finished(queue, queue.submit(raising(error)))
+    assert job['status'] == 'failed'
+    assert job['error'] == str(error)
+    assert job['code'] == code
+    assert job.get('retry_after') == retry_after
@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    monkeypatch.setattr(metrics, '_registry', [])
+    monkeypatch.setattr(metrics, '_collectors', [])
+    requests = metrics.Counter('test_requests_total', 'Requests.', ['status'])
+    seconds = metrics.Histogram('test_seconds', 'Seconds.', buckets=(1, 10))
+    metrics.register_collector(lambda: [('test_open', 'gauge', 'Open.', 1),
+                                        ('test_hits_total', 'counter', 'Hits.', 2)])
+    return tmp_path, requests, seconds
+
+
+def worker_snapshot(directory, pid, requests):
+    snapshot = {'metrics': {'test_requests_total': [[['200'], requests]],
+                            'test_seconds': [[[], [[1, 0, 1], 12.5, 2]]]},
+                'collected': [['test_open', 'gauge', 'Open.', 1], ['test_hits_total', 'counter', 'Hits.', 5]]}
+    with open(os.path.join(directory, f'{pid}.json'), 'w') as f:
+        json.dump(snapshot, f)
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_sums_live_workers(registry):
+    directory, requests, seconds = registry
+    requests.inc(status=200)
+    seconds.observe(0.5)
+    worker_snapshot(directory, os.getppid(), 3)
+    text = metrics.expose()
+    assert 'test_requests_total{status="200"} 4' in text
+    assert 'test_seconds_bucket{le="1"} 2' in text
+    assert 'test_seconds_bucket{le="+Inf"} 3' in text
+    assert 'test_seconds_count 3' in text
+    assert 'test_open 2' in text
+    assert 'test_hits_total 7' in text
+    assert 'pid=' not in text
+
+
+def test_keeps_counters_of_exited_workers(registry):
+    directory, requests, seconds = registry
+    pid = dead_pid()
+    worker_snapshot(directory, pid, 3)
+    text = metrics.expose()
+    assert 'test_requests_total{status="200"} 3' in text
+    assert 'test_hits_total 7' in text
+    # The gauge of the exited worker is gone; only this process's 1 remains.
+    assert 'test_open 1' in text
+    assert not os.path.exists(os.path.join(directory, f'{pid}.json'))
+    assert os.path.exists(os.path.join(directory, metrics.RETIRED))
+    # Folded once: a second scrape reports the same totals.
+    assert 'test_requests_total{status="200"} 3' in metrics.expose()
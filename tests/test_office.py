@@ -0,0 +1,115 @@
+import os
+import sys
+import stat
+
+import pytest
+
+import office
+
+# Copies each source to <name>.pdf like soffice does, creating the user profile it is given;
+# a source containing HANG hangs and one containing CRASH kills the run, as a LibreOffice crash would.
+STUB = """#!{python}
+import os, sys, time, shutil
+from urllib.parse import unquote, urlparse
+args = sys.argv[1:]
+for arg in args:
+    if arg.startswith('-env:UserInstallation='):
+        os.makedirs(unquote(urlparse(arg.split('=', 1)[1]).path), exist_ok=True)
+outdir = args[args.index('--outdir') + 1]
+for source in args[args.index('--outdir') + 2:]:
+    data = open(source, 'rb').read()
+    if b'HANG' in data:
+        time.sleep(60)
+    if b'CRASH' in data:
+        sys.exit(139)
+    target = os.path.join(outdir, os.path.splitext(os.path.basename(source))[0] + '.pdf')
+    shutil.copy(source, target)
+    print(f'convert {{source}} -> {{target}} using filter : writer_pdf_Export')
+"""
+
+@pytest.fixture
+def soffice(tmp_path, monkeypatch):
+    path = tmp_path / 'soffice'
+    path.write_text(STUB.format(python=sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('DOC_SOFFICE', str(path))
+    monkeypatch.setattr(office, 'POOL_SIZE', 0)
+    monkeypatch.setattr(office, 'CONVERT_RETRIES', 0)
+    return path
+
+@pytest.fixture
+def half_open(monkeypatch):
+    """
+    A breaker whose cooldown is over: the next conversion is its single trial.
+    """
+    breaker = office.CircuitBreaker(failures=1, reset_after=0)
+    breaker.failure()
+    monkeypatch.setattr(office, 'breaker', breaker)
+    return breaker
+
+def make_sources(folder, *contents):
+    sources = []
+    for i, content in enumerate(contents):
+        path = os.path.join(folder, f'{i}.docx')
+        with open(path, 'w') as f:
+            f.write(content)
+        sources.append(path)
+    return sources
+
+def names(results, sources):
+    return [os.path.basename(r) if isinstance(r, str) else type(r) for r in map(results.get, sources)]
+
+def test_crashed_run_settles_trial_and_converts_the_others(tmp_path, soffice, half_open):
+    sources = make_sources(str(tmp_path), 'ok', 'CRASH', 'ok')
+    results = office._convert_run(str(tmp_path), sources, 5)
+    assert names(results, sources) == ['0.pdf', office.ConversionCrashed, '2.pdf']
+    assert not half_open._trial
+    # The breaker is not stuck: a healthy conversion is let through and closes it.
+    folder = tmp_path / 'later'
+    folder.mkdir()
+    healthy = make_sources(str(folder), 'ok')[0]
+    assert os.path.basename(office._convert_to(str(folder), healthy, 5)) == '0.pdf'
+    assert half_open.state == 'closed'
+
+def test_timed_out_run_settles_trial(tmp_path, soffice, half_open):
+    sources = make_sources(str(tmp_path), 'ok', 'HANG')
+    results = office._convert_run(str(tmp_path), sources, 1)
+    assert names(results, sources) == ['0.pdf', office.ConversionTimeout]
+    assert not half_open._trial
+    half_open.allow()
+
+def test_unstartable_soffice_settles_trial(tmp_path, soffice, half_open, monkeypatch):
+    monkeypatch.setenv('DOC_SOFFICE', str(tmp_path / 'missing'))
+    sources = make_sources(str(tmp_path), 'ok', 'ok')
+    with pytest.raises(OSError):
+        office._convert_run(str(tmp_path), sources, 5)
+    assert not half_open._trial
+    assert half_open.state == 'open'
+    half_open.allow()
+
+def test_successful_run_closes_breaker(tmp_path, soffice, half_open):
+    sources = make_sources(str(tmp_path), 'ok', 'ok')
+    results = office._convert_run(str(tmp_path), sources, 5)
+    assert names(results, sources) == ['0.pdf', '1.pdf']
+    assert half_open.state == 'closed'
+
+@pytest.fixture
+def slots(tmp_path, monkeypatch):
+    slots = office.ConversionSlots(limit=3, slot_dir=str(tmp_path / 'slots'))
+    monkeypatch.setattr(office, '_slots', slots)
+    return slots
+
+def test_prewarm_creates_every_slot_profile(tmp_path, soffice, slots):
+    source = make_sources(str(tmp_path), 'ok')[0]
+    assert office.prewarm(str(tmp_path), source)
+    assert all(os.path.isdir(slots.profile_dir(i)) for i in range(3))
+
+def test_prewarm_skips_slots_in_use(tmp_path, soffice, slots):
+    source = make_sources(str(tmp_path), 'ok')[0]
+    with slots.hold(1) as profile_dir:
+        assert profile_dir == slots.profile_dir(1)
+        assert office.prewarm(str(tmp_path), source)
+    assert [os.path.isdir(slots.profile_dir(i)) for i in range(3)] == [True, False, True]
+    # The next warm-up only creates the missing one.
+    assert office.prewarm(str(tmp_path), source)
+    assert os.path.isdir(slots.profile_dir(1))
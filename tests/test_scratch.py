@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+from scratch import Scratch, ScratchFull
+
+
+def fill(path, size):
+    with open(os.path.join(path, 'blob'), 'wb') as f:
+        f.write(b'\0' * size)
+
+
+@pytest.fixture
+def scratch(tmp_path):
+    return Scratch(root=str(tmp_path / 'fast'), fallback_dir=str(tmp_path / 'disk'), quota=1000,
+                   usage_interval=0, min_free=0)
+
+
+def test_rejects_new_work_over_quota_across_both_dirs(scratch):
+    fill(scratch.mkdtemp(), 600)
+    os.makedirs(scratch.fallback_dir)
+    fill(scratch.fallback_dir, 600)
+    with pytest.raises(ScratchFull) as e:
+        scratch.mkdtemp()
+    assert e.value.status == 503 and e.value.retry_after
+    assert scratch.stats()['rejected'] == 1
+    # Work that was already let in still gets its directories.
+    assert os.path.isdir(scratch.mkdtemp(prefix='docgen-lo-', admit=False))
+
+
+def test_accepts_again_once_space_is_freed(scratch):
+    path = scratch.mkdtemp()
+    fill(path, 1200)
+    with pytest.raises(ScratchFull):
+        scratch.check()
+    scratch.remove(path)
+    scratch.check()
+
+
+def test_usage_is_walked_at_most_once_per_interval(scratch):
+    scratch.usage_interval = 3600
+    assert scratch.usage() == 0
+    fill(scratch.mkdtemp(), 1200)
+    assert scratch.usage() == 0
+    scratch.mkdtemp()
+
+
+def test_falls_back_to_disk_when_fast_volume_is_low(scratch):
+    scratch.min_free = float('inf')
+    path = scratch.mkdtemp()
+    assert os.path.dirname(path) == scratch.fallback_dir
+    assert scratch.stats()['fallbacks'] == 1
@@ -0,0 +1,27 @@
+import zipfile
+
+import pytest
+
+import skeleton
+
+
+def test_writes_one_paragraph_per_placeholder(tmp_path):
+    path = skeleton.write_skeleton({'name': 'x', 'items': [{'price': 1}]}, str(tmp_path / 'out.docx'))
+    with zipfile.ZipFile(path) as archive:
+        document = archive.read('word/document.xml').decode()
+    for text in ('{name}', '{#items}', '{price}', '{/items}'):
+        assert f'<w:t xml:space="preserve">{text}</w:t>' in document
+
+
+@pytest.mark.parametrize('key', ['a\x01b', 'nul\x00', 'bad￾', 'half\ud800'])
+def test_rejects_keys_xml_cannot_hold(tmp_path, key):
+    with pytest.raises(ValueError):
+        skeleton.write_skeleton({key: 'x'}, str(tmp_path / 'out.docx'))
+
+
+def test_keeps_allowed_whitespace_and_astral_characters(tmp_path):
+    path = skeleton.write_skeleton({'tab\there': 1, 'emoji\U0001f600': 2}, str(tmp_path / 'out.docx'))
+    with zipfile.ZipFile(path) as archive:
+        document = archive.read('word/document.xml').decode()
+    assert '{tab\there}' in document
+    assert '{emoji\U0001f600}' in document
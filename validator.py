@@ -0,0 +1,110 @@
+import re
+import zipfile
+
+from lxml import etree
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+PART_RE = re.compile(r'^word/(document|header\d*|footer\d*)\.xml$')
+
+# Jinja statements, optionally behind docxtpl's {%p / {%tr / {%tc / {%r prefixes.
+TAG_RE = re.compile(r'\{%[-+]?(?:(?:p|tr|tc|r)(?=\s))?\s*(\w*)(.*?)[-+]?%\}|\{%|\{#.*?#\}', re.S)
+
+BLOCK_TAGS = {'for', 'if', 'macro', 'call', 'filter', 'with', 'block', 'raw', 'autoescape', 'trans'}
+INNER_TAGS = {'elif': ('if',), 'else': ('if', 'for'), 'pluralize': ('trans',)}
+
+def _snippet(text, limit=60):
+    text = ' '.join(text.split())
+    return text if len(text) <= limit else text[:limit - 3] + '...'
+
+def iter_paragraphs(xml_file):
+    """
+    Stream (paragraph number, text) pairs from a WordprocessingML part. Text of all runs in a
+    paragraph is joined, so tags Word split across runs are seen whole. Paragraphs are numbered
+    in document order, matching the line numbers Jinja reports for docxtpl's rendered XML.
+    """
+    stack = []
+    number = 0
+    for event, elem in etree.iterparse(xml_file, events=('start', 'end'), tag=(W + 'p', W + 't')):
+        if elem.tag == W + 'p':
+            if event == 'start':
+                number += 1
+                stack.append((number, []))
+                continue
+            paragraph, texts = stack.pop()
+            yield paragraph, ''.join(texts)
+            if not stack:
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+        elif event == 'end' and stack and elem.text:
+            stack[-1][1].append(elem.text)
+
+def check_part(name, paragraphs):
+    """
+    Check Jinja statement balance over the paragraphs of one part in a single pass.
+    Returns a list of error messages.
+    """
+    errors = []
+    stack = []
+
+    def where(paragraph, text):
+        return f'{name}, paragraph {paragraph} ("{_snippet(text)}")'
+
+    for paragraph, text in paragraphs:
+        for match in TAG_RE.finditer(text):
+            token = match.group(0)
+            if token.startswith('{#'):
+                continue
+            if token == '{%':
+                errors.append(f"{where(paragraph, text)}: unterminated '{{%' tag.")
+                continue
+            tag, rest = match.group(1), match.group(2)
+            if stack and stack[-1][0] == 'raw' and tag != 'endraw':
+                continue
+
+            if tag in BLOCK_TAGS or (tag == 'set' and '=' not in rest):
+                stack.append((tag, paragraph, text))
+            elif tag.startswith('end') and tag[3:] in BLOCK_TAGS | {'set'}:
+                opener = tag[3:]
+                if stack and stack[-1][0] == opener:
+                    stack.pop()
+                elif any(entry[0] == opener for entry in stack):
+                    while stack[-1][0] != opener:
+                        open_tag, open_paragraph, open_text = stack.pop()
+                        errors.append(f"{where(open_paragraph, open_text)}: '{{% {open_tag} %}}' is never closed.")
+                    stack.pop()
+                else:
+                    errors.append(f"{where(paragraph, text)}: '{{% {tag} %}}' without matching '{{% {opener} %}}'.")
+            elif tag in INNER_TAGS:
+                if not stack or stack[-1][0] not in INNER_TAGS[tag]:
+                    errors.append(f"{where(paragraph, text)}: '{{% {tag} %}}' outside of "
+                                  + ' or '.join(f"'{{% {t} %}}'" for t in INNER_TAGS[tag]) + '.')
+
+    for open_tag, open_paragraph, open_text in stack:
+        errors.append(f"{where(open_paragraph, open_text)}: '{{% {open_tag} %}}' is never closed.")
+    return errors
+
+def find_template_errors(template_file):
+    """
+    Validate the body, header and footer parts of a .docx without loading it into python-docx.
+    """
+    errors = []
+    try:
+        archive = zipfile.ZipFile(template_file)
+    except zipfile.BadZipFile:
+        return ["Template is not a valid .docx file."]
+    with archive:
+        for name in archive.namelist():
+            if not PART_RE.match(name):
+                continue
+            try:
+                with archive.open(name) as xml_file:
+                    errors.extend(check_part(name, iter_paragraphs(xml_file)))
+            except etree.XMLSyntaxError as e:
+                errors.append(f"{name}: invalid XML ({e}).")
+    return errors
+
+def validate_template(template_file):
+    errors = find_template_errors(template_file)
+    if errors:
+        raise ValueError("Template syntax error: " + ' '.join(errors[:5]))
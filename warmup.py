@@ -0,0 +1,76 @@
+import time
+import importlib
+import threading
+
+from scratch import get_scratch
+
+class LazyModule:
+    """
+    Stand-in for a module that is only imported on first attribute access.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+class Warmup:
+    """
+    Boot warm-up run on a background thread: imports the lazy modules, then calls
+    convert(workdir) once so LibreOffice has its profile and running instances before the first
+    real PDF request. The instance is ready once both steps are done, whether or not the
+    conversion succeeded; a failure is reported in status().
+    """
+    def __init__(self, modules, convert=None):
+        self.modules = modules
+        self.convert = convert
+        self.started = False
+        self.imports_done = False
+        self.office_done = False
+        self.error = None
+        self.seconds = None
+        self._lock = threading.Lock()
+
+    def load_modules(self):
+        for module in self.modules:
+            module.load()
+        self.imports_done = True
+
+    def start(self):
+        with self._lock:
+            if self.started:
+                return
+            self.started = True
+        threading.Thread(target=self._run, name='doc-warmup', daemon=True).start()
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            self.load_modules()
+            if self.convert:
+                with get_scratch().workdir(prefix='docgen-warmup-', admit=False) as workdir:
+                    self.convert(workdir)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.office_done = True
+            self.seconds = time.perf_counter() - start
+
+    @property
+    def ready(self):
+        return self.imports_done and self.office_done
+
+    def status(self):
+        return {
+            'status': 'ready' if self.ready else 'warming',
+            'imports': self.imports_done,
+            'office': self.office_done if self.convert else None,
+            'error': self.error,
+            'seconds': self.seconds,
+        }